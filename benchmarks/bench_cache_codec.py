@@ -0,0 +1,85 @@
+"""
+Сравнение старого (json) и нового (cache_codec) формата хранения search_cache.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_cache_codec
+"""
+import json
+import random
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+from download_functions.cache_codec import encode_results, decode_results
+
+SOURCES = ['yandex', 'saavn', 'soundcloud', 'yt']
+
+
+def make_results(count: int, seed: int) -> list:
+    """Собирает список треков того же вида, что сохраняет handle_query."""
+    rnd = random.Random(seed)
+    results = []
+    for i in range(count):
+        source = rnd.choice(SOURCES)
+        track = {
+            'id': f"{rnd.randrange(10**8)}:{rnd.randrange(10**7)}",
+            'title': f"Track Title {i} (Extended Mix)",
+            'artist': rnd.choice(['Daft Punk', 'Noize MC, Монеточка', 'The Weeknd']),
+            'duration': rnd.randrange(90, 900),
+            'source': source,
+            'thumbnail_url': f"https://avatars.yandex.net/get-music-content/{rnd.randrange(10**7)}/{i:08x}/200x200",
+            'relevance_score': rnd.randrange(60, 101),
+            'source_priority': rnd.randrange(1, 4),
+        }
+        if source == 'soundcloud':
+            track['url'] = f"https://soundcloud.com/artist-{i}/track-title-{rnd.randrange(10**6)}"
+        results.append(track)
+    return results
+
+
+def bench_decode(name: str, blob, decode, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        decode(blob)
+    per_call_us = (time.perf_counter() - start) / rounds * 1e6
+    print(f"{name:<8} decode: {per_call_us:8.1f} мкс/вызов")
+    return per_call_us
+
+
+def db_size(rows: list) -> int:
+    """Размер файла SQLite с таблицей search_cache, заполненной rows."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.db"
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE search_cache (query_hash TEXT PRIMARY KEY, results TEXT, timestamp INTEGER)')
+        conn.executemany('INSERT INTO search_cache VALUES (?, ?, ?)', rows)
+        conn.commit()
+        conn.execute('VACUUM')
+        conn.close()
+        return path.stat().st_size
+
+
+def main():
+    results = make_results(40, seed=1)
+    json_blob = json.dumps(results)
+    codec_blob = encode_results(results)
+    assert decode_results(codec_blob) == results
+    assert decode_results(json_blob) == results
+
+    print(f"Одна запись ({len(results)} треков): json {len(json_blob)} Б, codec {len(codec_blob)} Б "
+          f"({len(json_blob) / len(codec_blob):.1f}x меньше)")
+
+    rounds = 5000
+    json_us = bench_decode('json', json_blob, json.loads, rounds)
+    codec_us = bench_decode('codec', codec_blob, decode_results, rounds)
+    print(f"Ускорение декодирования: {json_us / codec_us:.2f}x")
+
+    entries = [make_results(40, seed=i) for i in range(500)]
+    json_db = db_size([(f"h{i}", json.dumps(r), 0) for i, r in enumerate(entries)])
+    codec_db = db_size([(f"h{i}", encode_results(r), 0) for i, r in enumerate(entries)])
+    print(f"Файл БД на {len(entries)} запросов: json {json_db // 1024} КБ, codec {codec_db // 1024} КБ")
+
+
+if __name__ == '__main__':
+    main()
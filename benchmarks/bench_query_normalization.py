@@ -0,0 +1,83 @@
+"""
+Прогон журнала запросов через кэш поиска со старым и новым ключом.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_query_normalization [queries.txt]
+
+Файл журнала — по одному запросу в строке (в порядке поступления).
+Без аргумента используется встроенный пример с типичными вариациями запросов.
+"""
+import hashlib
+import os
+import sys
+
+# main.py создает Bot при импорте — для замера подойдет любой токен правильного вида
+os.environ.setdefault('TELEGRAM_TOKEN', '0:benchmark')
+
+from main import create_query_hash  # noqa: E402
+
+SAMPLE_LOG = [
+    "Daft Punk - One More Time",
+    "daft punk one more time",
+    "Daft Punk  - One More Time",
+    "ONE MORE TIME daft punk!",
+    "one more time daft punk (official video)",
+    "The Weeknd - Blinding Lights",
+    "the weeknd blinding lights lyrics",
+    "Blinding Lights The Weeknd",
+    "blinding lights - the weeknd (Official Audio)",
+    "Монеточка - Каждый раз",
+    "монеточка каждый раз",
+    "Монеточка — Каждый раз (клип)",
+    "Rick Astley Never Gonna Give You Up",
+    "never gonna give you up rick astley official music video",
+    "Never Gonna Give You Up - Rick Astley [HD]",
+    "Imagine Dragons Believer",
+    "imagine dragons - believer",
+    "Believer",
+    "Noize MC Выход в город",
+    "выход в город noize mc",
+    # Мусорные слова, которые на самом деле часть названия, и пунктуация в именах
+    "Сплин - Клип",
+    "Moby - Official",
+    "the hd",
+    "Official - Charlie",
+    "P!nk - So What",
+    "AC/DC - T.N.T.",
+]
+
+
+def legacy_query_hash(query: str) -> str:
+    """Ключ кэша до нормализации: только strip и lower."""
+    return hashlib.md5(query.strip().lower().encode()).hexdigest()
+
+
+def replay(queries: list, make_key) -> tuple[int, int]:
+    """Возвращает (попадания, уникальные ключи) для бесконечного кэша."""
+    seen = set()
+    hits = 0
+    for query in queries:
+        key = make_key(query)
+        if key in seen:
+            hits += 1
+        else:
+            seen.add(key)
+    return hits, len(seen)
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding='utf-8') as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = SAMPLE_LOG
+
+    total = len(queries)
+    for name, make_key in (('legacy', legacy_query_hash), ('normalized', create_query_hash)):
+        hits, unique = replay(queries, make_key)
+        print(f"{name:<10} hit rate: {hits / total:6.1%} ({hits}/{total}), "
+              f"поисков в источниках: {unique}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Сравнение прежнего (thefuzz, по одному треку) и пакетного (RapidFuzz) ранжирования.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_relevance_scoring
+
+Перед замером проверяется, что на наборе запросов порядок и оценки совпадают.
+"""
+import copy
+import os
+import random
+import re
+import time
+
+from thefuzz import fuzz as thefuzz_fuzz
+
+# main.py создает Bot при импорте — для замера подойдет любой токен правильного вида
+os.environ.setdefault('TELEGRAM_TOKEN', '0:benchmark')
+
+from main import merge_and_sort_results, RELEVANCE_THRESHOLD  # noqa: E402
+
+QUERIES = [
+    "daft punk one more time",
+    "Монеточка каждый раз",
+    "Beyoncé halo",
+    "the weeknd blinding lights",
+    "noize mc выход в город",
+    "ac dc back in black",
+]
+ARTISTS = ["Daft Punk", "Монеточка", "Beyoncé", "The Weeknd", "Noize MC", "AC/DC", "Unknown Artist", "DJ Snake"]
+TITLES = [
+    "One More Time", "Каждый раз", "Halo", "Blinding Lights (Official Video)", "Выход в город",
+    "Back In Black [Remastered]", "One More Time (Radio Edit)", "Lights", "Time", "Город",
+]
+SOURCES = ['yandex', 'saavn', 'soundcloud', 'yt']
+
+
+def legacy_merge_and_sort_results(query: str, all_results: list) -> list:
+    """Реализация до перехода на пакетный RapidFuzz — эталон для сравнения."""
+    source_priority = {'yandex': 3, 'saavn': 2, 'soundcloud': 2, 'yt': 1}
+    normalized_query = query.lower()
+    for track in all_results:
+        track_string_for_comparison = f"{track.get('artist', '')} {track.get('title', '')}".lower()
+        track['relevance_score'] = thefuzz_fuzz.token_set_ratio(normalized_query, track_string_for_comparison)
+
+    final_candidates = [track for track in all_results if track['relevance_score'] >= RELEVANCE_THRESHOLD]
+    for track in final_candidates:
+        track['source_priority'] = source_priority.get(track.get('source'), 0)
+
+    unique_tracks = {}
+    for track in final_candidates:
+        artist_norm = re.sub(r'[\(\[].*?[\)\]]', '', track.get('artist', '')).strip().lower()
+        title_norm = re.sub(r'[\(\[].*?[\)\]]', '', track.get('title', '')).strip().lower()
+        unique_key = f"{artist_norm} - {title_norm}"
+        if (unique_key not in unique_tracks or
+                track['relevance_score'] > unique_tracks[unique_key]['relevance_score'] or
+                (track['relevance_score'] == unique_tracks[unique_key]['relevance_score'] and
+                 track['source_priority'] > unique_tracks[unique_key]['source_priority'])):
+            unique_tracks[unique_key] = track
+
+    final_list = list(unique_tracks.values())
+    final_list.sort(key=lambda x: (x['relevance_score'], x['source_priority']), reverse=True)
+    return final_list
+
+
+def make_candidates(count: int, seed: int) -> list:
+    rnd = random.Random(seed)
+    candidates = []
+    for i in range(count):
+        track = {
+            'id': str(i),
+            'title': f"{rnd.choice(TITLES)}{rnd.choice(['', ' feat. Someone', ' (Remix)', ' - Live'])}",
+            'duration': rnd.randrange(60, 900),
+        }
+        # Как у search_tracks_optimized: у части треков нет artist/source
+        if rnd.random() > 0.2:
+            track['artist'] = rnd.choice(ARTISTS)
+            track['source'] = rnd.choice(SOURCES)
+        candidates.append(track)
+    return candidates
+
+
+def ranking(results: list) -> list:
+    return [(t['id'], t['relevance_score'], t['source_priority']) for t in results]
+
+
+def main():
+    fixture = make_candidates(500, seed=42)
+    for query in QUERIES:
+        legacy = legacy_merge_and_sort_results(query, copy.deepcopy(fixture))
+        batched = merge_and_sort_results(query, copy.deepcopy(fixture))
+        assert ranking(legacy) == ranking(batched), f"Ранжирование расходится для '{query}'"
+    print(f"Ранжирование совпадает на {len(QUERIES)} запросах x {len(fixture)} кандидатов.")
+
+    candidates = make_candidates(5000, seed=7)
+    rounds = 5
+    timings = {}
+    for name, merge in (('thefuzz', legacy_merge_and_sort_results), ('rapidfuzz', merge_and_sort_results)):
+        inputs = [copy.deepcopy(candidates) for _ in range(rounds * len(QUERIES))]
+        start = time.perf_counter()
+        for i, query in enumerate(QUERIES * rounds):
+            merge(query, inputs[i])
+        timings[name] = (time.perf_counter() - start) / len(inputs) * 1000
+        print(f"{name:<10} {timings[name]:7.2f} мс на {len(candidates)} кандидатов")
+    print(f"Ускорение: {timings['thefuzz'] / timings['rapidfuzz']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
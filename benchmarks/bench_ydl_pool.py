@@ -0,0 +1,77 @@
+"""
+CPU-время на один поиск yt-dlp: новый YoutubeDL на каждый вызов против пула.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_ydl_pool            # только накладные расходы, без сети
+    python -m benchmarks.bench_ydl_pool --live "daft punk one more time"
+
+Без --live замеряется то, что поиск платит до первого сетевого запроса:
+создание YoutubeDL (реестр экстракторов, HTTP-опенер) и получение экстрактора поиска.
+С --live выполняются настоящие поиски ytsearch, и в CPU-время входит разбор ответа.
+"""
+import sys
+import time
+
+import yt_dlp
+
+from download_functions.yt_download import get_search_ydl_opts
+from download_functions.ydl_pool import YDLPool
+
+ROUNDS = 30
+LIVE_ROUNDS = 5
+
+
+def fresh_setup():
+    with yt_dlp.YoutubeDL(get_search_ydl_opts()) as ydl:
+        ydl.get_info_extractor('YoutubeSearch')
+
+
+def pooled_setup(pool: YDLPool):
+    with pool.borrow() as ydl:
+        ydl.get_info_extractor('YoutubeSearch')
+
+
+def fresh_search(query: str):
+    with yt_dlp.YoutubeDL(get_search_ydl_opts()) as ydl:
+        ydl.extract_info(f"ytsearch10:{query}", download=False)
+
+
+def pooled_search(pool: YDLPool, query: str):
+    with pool.borrow() as ydl:
+        ydl.extract_info(f"ytsearch10:{query}", download=False)
+
+
+def cpu_per_call(func, rounds: int) -> float:
+    """Среднее процессорное время одного вызова, мс."""
+    start = time.process_time()
+    for _ in range(rounds):
+        func()
+    return (time.process_time() - start) / rounds * 1000
+
+
+def main():
+    live_query = None
+    if '--live' in sys.argv:
+        index = sys.argv.index('--live')
+        live_query = sys.argv[index + 1] if len(sys.argv) > index + 1 else "daft punk one more time"
+
+    pool = YDLPool('bench', get_search_ydl_opts(), size=1)
+    pool.warm()
+
+    if live_query:
+        rounds = LIVE_ROUNDS
+        fresh = cpu_per_call(lambda: fresh_search(live_query), rounds)
+        pooled = cpu_per_call(lambda: pooled_search(pool, live_query), rounds)
+    else:
+        rounds = ROUNDS
+        fresh = cpu_per_call(fresh_setup, rounds)
+        pooled = cpu_per_call(lambda: pooled_setup(pool), rounds)
+
+    print(f"{'fresh':<8} {fresh:8.2f} мс CPU на поиск")
+    print(f"{'pooled':<8} {pooled:8.2f} мс CPU на поиск")
+    print(f"Экономия: {fresh - pooled:.2f} мс CPU на поиск, {rounds} повторов")
+    print(f"Пул: {pool.as_dict()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BASE_DIR = Path(__file__).resolve().parent
+AUDIO_CACHE_DIR = Path(os.getenv('AUDIO_CACHE_DIR', BASE_DIR / "audio_cache"))
+AUDIO_CACHE_MAX_BYTES = int(os.getenv('AUDIO_CACHE_MAX_BYTES', 2 * 1024 ** 3))  # 2 ГБ
+# Недавно выданные файлы не вытесняются: их может еще читать send_audio
+AUDIO_CACHE_MIN_AGE = 600
+
+# Индекс кэша в порядке LRU: ключ -> суммарный размер файлов записи
+_index: OrderedDict[str, int] = OrderedDict()
+_last_access: dict[str, float] = {}
+_total_bytes = 0
+_lock = asyncio.Lock()
+audio_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def _cache_key(source: str, track_id: str) -> str:
+    return hashlib.sha256(f"{source}:{track_id}".encode()).hexdigest()
+
+def _entry_paths(key: str) -> tuple[Path, Path, Path]:
+    """Пути к аудио, обложке и метаданным записи."""
+    directory = AUDIO_CACHE_DIR / key[:2]
+    return directory / f"{key}.audio", directory / f"{key}.cover", directory / f"{key}.json"
+
+def _temp_path_for(path: Path) -> str:
+    """Уникальный временный файл рядом с path: одновременные записи одного трека не пересекаются."""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f"{path.name}.", suffix='.tmp')
+    os.close(fd)
+    return tmp_path
+
+def _atomic_write(path: Path, data: bytes):
+    """Пишет файл во временный и атомарно переименовывает, чтобы не оставить обрывок."""
+    tmp_path = _temp_path_for(path)
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+def _atomic_move(source_path: str, path: Path):
+    """Переносит готовый файл в кэш: копирование по частям (если другой диск) идет во временный файл."""
+    tmp_path = _temp_path_for(path)
+    try:
+        shutil.move(source_path, tmp_path)
+        os.replace(tmp_path, path)
+    except OSError:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+def _entry_info(audio_path: Path, cover_path: Path, meta: dict) -> dict:
+    """Запись кэша в виде info-словаря, как у download_track_*, но с путями вместо байтов."""
+    return {
+        'audio_path': str(audio_path),
+        'thumbnail_path': str(cover_path) if meta.get('has_cover') else None,
+        'title': meta.get('title'),
+        'artist': meta.get('artist'),
+        'duration': meta.get('duration'),
+        'extension': meta.get('extension', 'm4a'),
+    }
+
+def _remove_entry_files(key: str):
+    for path in _entry_paths(key):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+def _scan_cache_dir() -> list[tuple[float, str, int]]:
+    """Собирает записи кэша с диска: (время последнего доступа, ключ, размер)."""
+    AUDIO_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    entries = []
+    for meta_path in AUDIO_CACHE_DIR.glob('*/*.json'):
+        key = meta_path.stem
+        audio_path, cover_path, _ = _entry_paths(key)
+        if not audio_path.exists():
+            meta_path.unlink(missing_ok=True)
+            continue
+        size = audio_path.stat().st_size + meta_path.stat().st_size
+        if cover_path.exists():
+            size += cover_path.stat().st_size
+        entries.append((meta_path.stat().st_mtime, key, size))
+    # Обрывки незавершенных записей после падения процесса
+    for tmp_path in AUDIO_CACHE_DIR.glob('*/*.tmp'):
+        tmp_path.unlink(missing_ok=True)
+    return sorted(entries)
+
+async def init_audio_cache():
+    """Загружает индекс дискового кэша аудио и подрезает его под лимит."""
+    global _total_bytes
+    entries = await asyncio.to_thread(_scan_cache_dir)
+    async with _lock:
+        _index.clear()
+        _total_bytes = 0
+        for _mtime, key, size in entries:
+            _index[key] = size
+            _total_bytes += size
+        await _evict_if_needed()
+    print(f"💾 Кэш аудио: {len(_index)} треков, {_total_bytes // (1024 * 1024)} МБ "
+          f"(лимит {AUDIO_CACHE_MAX_BYTES // (1024 * 1024)} МБ).")
+
+async def _evict_if_needed():
+    """Удаляет самые давно использованные записи, пока кэш не уложится в лимит. Вызывать под _lock."""
+    global _total_bytes
+    now = time.time()
+    for key in list(_index):
+        if _total_bytes <= AUDIO_CACHE_MAX_BYTES:
+            break
+        if now - _last_access.get(key, 0) < AUDIO_CACHE_MIN_AGE:
+            continue
+        _total_bytes -= _index.pop(key)
+        _last_access.pop(key, None)
+        audio_cache_stats['evictions'] += 1
+        await asyncio.to_thread(_remove_entry_files, key)
+
+def is_audio_cached(source: str, track_id: str) -> bool:
+    """Есть ли трек в кэше (без учета в статистике попаданий)."""
+    return _cache_key(source, track_id) in _index
+
+async def get_cached_audio(source: str, track_id: str) -> dict | None:
+    """
+    Возвращает трек из дискового кэша в виде info-словаря, как у download_track_*,
+    но с путями 'audio_path' / 'thumbnail_path' вместо байтов.
+    """
+    global _total_bytes
+    key = _cache_key(source, track_id)
+    if key not in _index:
+        audio_cache_stats['misses'] += 1
+        return None
+    audio_path, cover_path, meta_path = _entry_paths(key)
+    try:
+        meta = json.loads(await asyncio.to_thread(meta_path.read_bytes))
+        # mtime метаданных хранит время последнего доступа между перезапусками
+        await asyncio.to_thread(os.utime, meta_path)
+    except (OSError, ValueError) as e:
+        print(f"Audio cache entry {key} is broken: {e}")
+        async with _lock:
+            if key in _index:
+                _total_bytes -= _index.pop(key)
+                _last_access.pop(key, None)
+            await asyncio.to_thread(_remove_entry_files, key)
+        audio_cache_stats['misses'] += 1
+        return None
+
+    _index.move_to_end(key)
+    _last_access[key] = time.time()
+    audio_cache_stats['hits'] += 1
+    return _entry_info(audio_path, cover_path, meta)
+
+async def save_audio_to_cache(source: str, track_id: str, info: dict) -> dict | None:
+    """
+    Сохраняет скачанный трек в дисковый кэш: байты из 'audio_bytes' или файл
+    из 'audio_path' (он переносится в кэш, а не копируется в память).
+    Возвращает запись кэша, как get_cached_audio, или None, если сохранить не удалось.
+    """
+    global _total_bytes
+    audio_bytes = info.get('audio_bytes')
+    source_path = info.get('audio_path')
+    if not audio_bytes and not source_path:
+        return None
+    key = _cache_key(source, track_id)
+    audio_path, cover_path, meta_path = _entry_paths(key)
+    thumbnail_bytes = info.get('thumbnail_bytes')
+    meta_dict = {
+        'title': info.get('title'),
+        'artist': info.get('artist'),
+        'duration': info.get('duration'),
+        'extension': info.get('extension', 'm4a'),
+        'has_cover': bool(thumbnail_bytes),
+    }
+    meta = json.dumps(meta_dict).encode()
+
+    def _write() -> int:
+        audio_path.parent.mkdir(parents=True, exist_ok=True)
+        if source_path:
+            _atomic_move(source_path, audio_path)
+        else:
+            _atomic_write(audio_path, audio_bytes)
+        if thumbnail_bytes:
+            _atomic_write(cover_path, thumbnail_bytes)
+        # Метаданные пишутся последними: их наличие означает, что запись целая
+        _atomic_write(meta_path, meta)
+        return audio_path.stat().st_size
+
+    try:
+        audio_size = await asyncio.to_thread(_write)
+    except OSError as e:
+        print(f"Could not write {source}:{track_id} to audio cache: {e}")
+        async with _lock:
+            # Этот же трек мог успеть сохранить параллельный вызов — его запись не трогаем
+            if key not in _index:
+                await asyncio.to_thread(_remove_entry_files, key)
+        return None
+
+    size = audio_size + len(meta) + (len(thumbnail_bytes) if thumbnail_bytes else 0)
+    async with _lock:
+        _total_bytes += size - _index.pop(key, 0)
+        _index[key] = size
+        _last_access[key] = time.time()
+        await _evict_if_needed()
+    return _entry_info(audio_path, cover_path, meta_dict)
+
+def get_audio_cache_stats() -> dict:
+    return {**audio_cache_stats, 'entries': len(_index), 'bytes': _total_bytes}
@@ -0,0 +1,34 @@
+import json
+import marshal
+import zlib
+
+# Формат хранения результатов поиска в search_cache.
+# Версия 1: 1 байт версии + zlib(marshal(results)).
+# marshal разбирается быстрее json, а zlib сжимает повторяющиеся ключи и URL обложек.
+CODEC_VERSION = 1
+MARSHAL_VERSION = 4  # Фиксируем формат marshal, чтобы он не зависел от версии Python
+COMPRESSION_LEVEL = 6
+
+
+def encode_results(results: list) -> bytes:
+    """Кодирует список треков в компактный бинарный вид для search_cache."""
+    payload = zlib.compress(marshal.dumps(results, MARSHAL_VERSION), COMPRESSION_LEVEL)
+    return bytes([CODEC_VERSION]) + payload
+
+
+def decode_results(data: bytes | str) -> list:
+    """
+    Декодирует результаты из search_cache.
+    Строки — старый формат (json.dumps), они читаются как раньше.
+    """
+    if isinstance(data, str):
+        return json.loads(data)
+    version = data[0]
+    if version == 1:
+        return marshal.loads(zlib.decompress(data[1:]))
+    raise ValueError(f"Неизвестная версия формата кэша поиска: {version}")
+
+
+def is_legacy(data: bytes | str) -> bool:
+    """Проверяет, хранится ли запись в старом текстовом формате."""
+    return isinstance(data, str)
@@ -0,0 +1,127 @@
+import contextvars
+import os
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Сколько сбоев подряд размыкают предохранитель источника
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 5))
+# Через сколько секунд после размыкания пропускается пробный запрос
+BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', 60))
+
+# Фоновые запросы, которых пользователь не просил (предзагрузка): их сбои не размыкают
+# предохранитель, и пробным запросом к разомкнутому источнику они не становятся
+_speculative = contextvars.ContextVar('breaker_speculative', default=False)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class SourceRejected(Exception):
+    """Источник пропущен без запроса (предохранитель разомкнут или источник не настроен)."""
+
+
+class SourceFailed(Exception):
+    """Запрос к источнику не удался; предохранитель источника об этом уже знает."""
+
+
+class CircuitBreaker:
+    """
+    Предохранитель одного источника (общий для поиска и скачивания).
+    closed — запросы идут как обычно; open — источник пропускается без запроса;
+    half_open — пропущен один пробный запрос, его исход решает, замкнуть или снова разомкнуть.
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self.speculative_failures = 0
+
+    def is_open(self) -> bool:
+        """Источник сейчас пропускается: разомкнут, и пробный запрос еще рано (или уже идет)."""
+        now = time.monotonic()
+        if self.state == OPEN:
+            return now - self.opened_at < BREAKER_RESET_TIMEOUT
+        if self.state == HALF_OPEN:
+            # Пробный запрос, не вернувший исхода, не должен блокировать источник навсегда
+            return now - self.probe_started < BREAKER_RESET_TIMEOUT
+        return False
+
+    def allow_request(self) -> bool:
+        """Можно ли обращаться к источнику. В разомкнутом состоянии пропускает пробный запрос."""
+        if self.state == CLOSED:
+            return True
+        if self.is_open() or _speculative.get():
+            self.rejected += 1
+            return False
+        if self.state == OPEN:
+            print(f"🔌 Source {self.source}: sending a probe request.")
+        self.state = HALF_OPEN
+        self.probe_started = time.monotonic()
+        return True
+
+    def record_success(self):
+        if self.state != CLOSED:
+            print(f"🔌 Source {self.source} is back, circuit closed.")
+        self.state = CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        if _speculative.get():
+            self.speculative_failures += 1
+            return
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= BREAKER_FAILURE_THRESHOLD:
+            if self.state != OPEN:
+                self.trips += 1
+                print(f"🔌 Source {self.source} failed {self.failures} time(s) in a row, "
+                      f"circuit open for {BREAKER_RESET_TIMEOUT:g}s.")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def as_dict(self) -> dict:
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'trips': self.trips,
+            'rejected': self.rejected,
+            'speculative_failures': self.speculative_failures,
+        }
+
+
+breakers: dict[str, CircuitBreaker] = {}
+
+
+def set_speculative():
+    """Помечает текущую задачу asyncio как фоновую: ее сбои не идут в предохранители."""
+    _speculative.set(True)
+
+def get_breaker(source: str) -> CircuitBreaker:
+    if source not in breakers:
+        breakers[source] = CircuitBreaker(source)
+    return breakers[source]
+
+def is_source_open(source: str) -> bool:
+    return get_breaker(source).is_open()
+
+def get_open_sources() -> list[str]:
+    return [source for source, breaker in breakers.items() if breaker.is_open()]
+
+def get_breaker_states() -> dict:
+    return {source: breaker.as_dict() for source, breaker in breakers.items()}
+
+def format_breaker_states() -> str:
+    """Короткая сводка по предохранителям для логов."""
+    return "\n".join(
+        f"{source}: {state['state']}, сбоев подряд {state['failures']}, "
+        f"размыканий {state['trips']}, отклонено {state['rejected']}, "
+        f"сбоев предзагрузки {state['speculative_failures']}"
+        for source, state in get_breaker_states().items()
+    )
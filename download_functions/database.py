@@ -1,141 +1,468 @@
 import aiosqlite
-import json
+import asyncio
+import sys
 import time
 import os
+from collections import deque
+from cachetools import TLRUCache
 from pathlib import Path
 from dotenv import load_dotenv
 
+from download_functions.cache_codec import encode_results, decode_results, is_legacy
+
 load_dotenv()
 
 BASE_DIR = Path(__file__).resolve().parent
 DB_PATH = BASE_DIR / "music_bot.db"
-CACHE_TTL = 7200  # 2 часа в секундах для кэша поиска и ссылок
+CACHE_TTL = 7200  # 2 часа в секундах для кэша поиска
 
-async def init_db():
-    """Инициализирует базу данных и создает таблицы, если их нет."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS user_downloads (
-                user_id INTEGER,
-                track_id TEXT,
-                download_time INTEGER,
-                title TEXT,
-                artist TEXT,
-                duration INTEGER
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS search_cache (
-                query_hash TEXT PRIMARY KEY,
-                results TEXT,
-                timestamp INTEGER
-            )
-        ''')
-        # НОВАЯ ТАБЛИЦА: для хранения временных ссылок SoundCloud
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS soundcloud_urls (
-                url_hash TEXT PRIMARY KEY,
-                full_url TEXT,
-                timestamp INTEGER
-            )
-        ''')
+# Кэш поиска: после мягкого TTL результаты отдаются сразу, но обновляются в фоне,
+# после жесткого TTL запись удаляется
+SEARCH_SOFT_TTL = CACHE_TTL
+SEARCH_HARD_TTL = int(os.getenv('SEARCH_HARD_TTL', 86400))
+
+# --- Настройки соединения с БД ---
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', 16384))  # Кэш страниц SQLite (16 МБ)
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', 64 * 1024 * 1024))  # Отображение файла БД в память (64 МБ)
+DB_STATEMENT_CACHE = 128  # Сколько подготовленных выражений переиспользует sqlite3
+
+# --- Отложенная запись (write-behind) ---
+WRITE_BATCH_SIZE = int(os.getenv('DB_WRITE_BATCH_SIZE', 100))  # Сброс буфера при таком числе записей
+WRITE_FLUSH_INTERVAL = float(os.getenv('DB_WRITE_FLUSH_INTERVAL', 5))  # ...или раз в столько секунд
+
+# --- Кэш поиска в памяти (первый уровень перед search_cache) ---
+SEARCH_LRU_MAX_ENTRIES = int(os.getenv('SEARCH_LRU_MAX_ENTRIES', 2000))
+SEARCH_LRU_MAX_BYTES = int(os.getenv('SEARCH_LRU_MAX_BYTES', 64 * 1024 * 1024))
+
+# --- Суточные квоты скачиваний ---
+DOWNLOAD_WINDOW = 86400  # Окно лимита скачиваний: 24 часа
+DOWNLOAD_HISTORY_RETENTION_DAYS = int(os.getenv('DOWNLOAD_HISTORY_RETENTION_DAYS', 30))  # Сколько хранить историю
+
+# Единое долгоживущее соединение: открывается в init_db и закрывается в close_db
+_db: aiosqlite.Connection | None = None
+
+# Буферы вставок, которые еще не попали в БД
+_pending_downloads: list[tuple] = []  # строки для user_downloads
+_pending_soundcloud_urls: dict[str, tuple[str, int]] = {}  # url_hash -> (full_url, timestamp)
+_pending_telegram_files: dict[str, tuple] = {}  # track_key -> (file_id, title, artist, duration, timestamp)
+_flush_lock = asyncio.Lock()
+# Все запросы идут через одно соединение и одну неявную транзакцию: запись вместе с commit
+# (или rollback) выполняется под этой блокировкой, чтобы не захватить чужие незакоммиченные изменения
+_write_lock = asyncio.Lock()
+_flush_task: asyncio.Task | None = None
+
+# query_hash -> (results, timestamp, примерный размер в байтах).
+# Срок жизни считается от timestamp записи, как и в SQLite, поэтому уровни не расходятся по TTL.
+_search_lru = TLRUCache(
+    maxsize=SEARCH_LRU_MAX_BYTES,
+    ttu=lambda _key, entry, _now: entry[1] + SEARCH_HARD_TTL,
+    timer=time.time,
+    getsizeof=lambda entry: entry[2],
+)
+search_cache_stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'stale_hits': 0}
+
+# Время скачиваний каждого пользователя за последние 24 часа (по возрастанию)
+_user_download_times: dict[int, deque[int]] = {}
+_download_counters_warmed = False
+
+
+async def get_db() -> aiosqlite.Connection:
+    """
+    Возвращает общее соединение с БД, открывая его при первом обращении.
+    Все запросы используют постоянные SQL-строки, поэтому sqlite3 берет
+    подготовленные выражения из своего кэша, а не компилирует их заново.
+    """
+    global _db
+    if _db is None:
+        db = await aiosqlite.connect(DB_PATH, cached_statements=DB_STATEMENT_CACHE)
+        # WAL позволяет читать во время записи и сильно удешевляет commit
+        await db.execute('PRAGMA journal_mode=WAL')
+        # В режиме WAL synchronous=NORMAL безопасен и не делает fsync на каждый commit
+        await db.execute('PRAGMA synchronous=NORMAL')
+        await db.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+        await db.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE}')
+        await db.execute('PRAGMA temp_store=MEMORY')
+        await db.execute('PRAGMA busy_timeout=5000')
+        _db = db
+    return _db
+
+async def _execute_write(sql: str, params: tuple = ()) -> aiosqlite.Cursor:
+    """Выполняет один изменяющий запрос и сразу его коммитит под _write_lock."""
+    db = await get_db()
+    async with _write_lock:
+        cursor = await db.execute(sql, params)
         await db.commit()
+    return cursor
+
+async def flush_pending_writes():
+    """Записывает накопленные вставки в БД одной транзакцией."""
+    if not _pending_downloads and not _pending_soundcloud_urls and not _pending_telegram_files:
+        return
+    async with _flush_lock:
+        downloads = _pending_downloads[:]
+        soundcloud_urls = dict(_pending_soundcloud_urls)
+        telegram_files = dict(_pending_telegram_files)
+        if not downloads and not soundcloud_urls and not telegram_files:
+            return
+        db = await get_db()
+        # Весь пакет — своя транзакция под _write_lock: откат не задевает чужие записи,
+        # а чужой commit не может зафиксировать половину пакета
+        async with _write_lock:
+            try:
+                await db.execute('BEGIN')
+                if downloads:
+                    await db.executemany(
+                        'INSERT INTO user_downloads (user_id, track_id, download_time, title, artist, duration) VALUES (?, ?, ?, ?, ?, ?)',
+                        downloads
+                    )
+                if soundcloud_urls:
+                    await db.executemany(
+                        'INSERT OR REPLACE INTO soundcloud_urls (url_hash, full_url, timestamp) VALUES (?, ?, ?)',
+                        [(url_hash, full_url, ts) for url_hash, (full_url, ts) in soundcloud_urls.items()]
+                    )
+                if telegram_files:
+                    await db.executemany(
+                        'INSERT OR REPLACE INTO telegram_files (track_key, file_id, title, artist, duration, timestamp) VALUES (?, ?, ?, ?, ?, ?)',
+                        [(track_key, *row) for track_key, row in telegram_files.items()]
+                    )
+                await db.commit()
+            except Exception as e:
+                # Буферы не трогаем: записи уйдут при следующем сбросе
+                print(f"❌ Ошибка записи буфера в БД: {e}")
+                await db.rollback()
+                return
+        # Пока шла запись, в буферы могли добавиться новые элементы — удаляем только записанное
+        del _pending_downloads[:len(downloads)]
+        for url_hash, value in soundcloud_urls.items():
+            if _pending_soundcloud_urls.get(url_hash) == value:
+                del _pending_soundcloud_urls[url_hash]
+        for track_key, value in telegram_files.items():
+            if _pending_telegram_files.get(track_key) == value:
+                del _pending_telegram_files[track_key]
+
+async def _periodic_flush():
+    """Фоновый сброс буфера записей по таймеру."""
+    while True:
+        await asyncio.sleep(WRITE_FLUSH_INTERVAL)
+        try:
+            await flush_pending_writes()
+        except Exception as e:
+            print(f"❌ Ошибка фонового сброса буфера БД: {e}")
+
+async def close_db():
+    """Сбрасывает буфер записей и закрывает общее соединение с БД."""
+    global _db, _flush_task
+    if _flush_task:
+        _flush_task.cancel()
+        _flush_task = None
+    if _db is None:
+        return
+    try:
+        await flush_pending_writes()
+        await _db.close()
+        print("🗄️ Соединение с БД закрыто.")
+    except Exception as e:
+        print(f"Ошибка при закрытии БД: {e}")
+    _db = None
+
+async def init_db():
+    """Открывает соединение с БД и создает таблицы, если их нет."""
+    db = await get_db()
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS user_downloads (
+            user_id INTEGER,
+            track_id TEXT,
+            download_time INTEGER,
+            title TEXT,
+            artist TEXT,
+            duration INTEGER
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS search_cache (
+            query_hash TEXT PRIMARY KEY,
+            results TEXT,
+            timestamp INTEGER
+        )
+    ''')
+    # НОВАЯ ТАБЛИЦА: для хранения временных ссылок SoundCloud
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS soundcloud_urls (
+            url_hash TEXT PRIMARY KEY,
+            full_url TEXT,
+            timestamp INTEGER
+        )
+    ''')
+    # file_id уже отправленных в Telegram треков: повторная отправка без скачивания
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS telegram_files (
+            track_key TEXT PRIMARY KEY,
+            file_id TEXT,
+            title TEXT,
+            artist TEXT,
+            duration INTEGER,
+            timestamp INTEGER
+        )
+    ''')
+    # Составной индекс под подсчет скачиваний пользователя за период
+    await db.execute(
+        'CREATE INDEX IF NOT EXISTS idx_user_downloads_user_time ON user_downloads (user_id, download_time)'
+    )
+    await db.commit()
+
+    await _warm_download_counters()
+    await migrate_search_cache()
+
+    global _flush_task
+    if _flush_task is None:
+        _flush_task = asyncio.create_task(_periodic_flush())
     print("🗄️ База данных инициализирована.")
 
+async def _warm_download_counters():
+    """Загружает в память скачивания за последние 24 часа, чтобы проверка лимита не ходила в БД."""
+    global _download_counters_warmed
+    cutoff_time = int(time.time()) - DOWNLOAD_WINDOW
+    db = await get_db()
+    _user_download_times.clear()
+    async with db.execute(
+        'SELECT user_id, download_time FROM user_downloads WHERE download_time > ? ORDER BY download_time',
+        (cutoff_time,)
+    ) as cursor:
+        async for user_id, download_time in cursor:
+            _user_download_times.setdefault(user_id, deque()).append(download_time)
+    _download_counters_warmed = True
+    print(f"🗄️ Счетчики скачиваний загружены для {len(_user_download_times)} пользователей.")
+
+def _prune_download_times(user_id: int, cutoff_time: int) -> deque | None:
+    """Удаляет из счетчика пользователя скачивания старше окна лимита."""
+    times = _user_download_times.get(user_id)
+    if times is None:
+        return None
+    while times and times[0] <= cutoff_time:
+        times.popleft()
+    if not times:
+        del _user_download_times[user_id]
+        return None
+    return times
+
 async def save_user_track(user_id: int, track_id: str, info: dict):
-    """Сохраняет информацию о скачанном треке."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            'INSERT INTO user_downloads (user_id, track_id, download_time, title, artist, duration) VALUES (?, ?, ?, ?, ?, ?)',
-            (
-                user_id, track_id, int(time.time()),
-                info.get('title'), info.get('artist'), info.get('duration')
-            )
-        )
-        await db.commit()
+    """Ставит информацию о скачанном треке в буфер записи и обновляет счетчик пользователя."""
+    download_time = int(time.time())
+    _pending_downloads.append((
+        user_id, track_id, download_time,
+        info.get('title'), info.get('artist'), info.get('duration')
+    ))
+    _user_download_times.setdefault(user_id, deque()).append(download_time)
+    if len(_pending_downloads) >= WRITE_BATCH_SIZE:
+        await flush_pending_writes()
 
 async def get_user_daily_downloads(user_id: int) -> int:
     """Считает количество треков, скачанных пользователем за последние 24 часа."""
-    twenty_four_hours_ago = int(time.time()) - 86400
-    async with aiosqlite.connect(DB_PATH) as db:
+    twenty_four_hours_ago = int(time.time()) - DOWNLOAD_WINDOW
+    if _download_counters_warmed:
+        times = _prune_download_times(user_id, twenty_four_hours_ago)
+        return len(times) if times else 0
+
+    # Счетчики еще не загружены (init_db не вызывался) — считаем по индексу в БД
+    db = await get_db()
+    # Под блокировкой сброса строка не может оказаться одновременно и в буфере, и в БД
+    async with _flush_lock:
+        pending = sum(
+            1 for row in _pending_downloads
+            if row[0] == user_id and row[2] > twenty_four_hours_ago
+        )
         async with db.execute(
             'SELECT COUNT(*) FROM user_downloads WHERE user_id = ? AND download_time > ?',
             (user_id, twenty_four_hours_ago)
         ) as cursor:
             row = await cursor.fetchone()
-            return row[0] if row else 0
+    return (row[0] if row else 0) + pending
+
+async def cleanup_old_downloads():
+    """Периодическая очистка старой истории скачиваний и пустых счетчиков в памяти."""
+    cutoff_time = int(time.time()) - DOWNLOAD_WINDOW
+    for user_id in list(_user_download_times):
+        _prune_download_times(user_id, cutoff_time)
+
+    history_cutoff = int(time.time()) - DOWNLOAD_HISTORY_RETENTION_DAYS * 86400
+    cursor = await _execute_write('DELETE FROM user_downloads WHERE download_time < ?', (history_cutoff,))
+    if cursor.rowcount > 0:
+        print(f"🧹 Очистка истории скачиваний: удалено {cursor.rowcount} записей старше {DOWNLOAD_HISTORY_RETENTION_DAYS} дн.")
 
 # --- Функции для кэша поиска ---
 
+def _approx_results_size(results: list) -> int:
+    """Грубая оценка памяти, занимаемой списком треков."""
+    size = sys.getsizeof(results)
+    for track in results:
+        size += sys.getsizeof(track) + sum(sys.getsizeof(value) for value in track.values())
+    return size
+
+def _remember_search(query_hash: str, results: list, timestamp: int):
+    """Кладет результаты в кэш в памяти, соблюдая лимит по числу записей."""
+    entry = (results, timestamp, _approx_results_size(results))
+    if entry[2] > SEARCH_LRU_MAX_BYTES:
+        return
+    while query_hash not in _search_lru and len(_search_lru) >= SEARCH_LRU_MAX_ENTRIES:
+        _search_lru.popitem()
+    _search_lru[query_hash] = entry
+
+def _is_search_stale(timestamp: int) -> bool:
+    """Проверяет, прошел ли мягкий TTL записи кэша поиска."""
+    stale = time.time() - timestamp >= SEARCH_SOFT_TTL
+    if stale:
+        search_cache_stats['stale_hits'] += 1
+    return stale
+
+def get_search_cache_stats() -> dict:
+    """Возвращает счетчики попаданий кэша поиска по уровням."""
+    hits = search_cache_stats['memory_hits'] + search_cache_stats['db_hits']
+    lookups = hits + search_cache_stats['misses']
+    return {
+        **search_cache_stats,
+        'hit_rate': hits / lookups if lookups else 0.0,
+        'memory_entries': len(_search_lru),
+        'memory_bytes': _search_lru.currsize,
+    }
+
 async def get_cached_search(query_hash: str) -> list | None:
-    """Получает результаты поиска из кэша БД, если они не устарели."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            'SELECT results, timestamp FROM search_cache WHERE query_hash = ?',
-            (query_hash,)
-        ) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                results, timestamp = row
-                if time.time() - timestamp < CACHE_TTL:
-                    return json.loads(results)
-                else:
-                    await db.execute('DELETE FROM search_cache WHERE query_hash = ?', (query_hash,))
-                    await db.commit()
+    """Получает результаты поиска из кэша, если они не старше жесткого TTL."""
+    entry = await get_cached_search_entry(query_hash)
+    return entry[0] if entry else None
+
+async def get_cached_search_entry(query_hash: str) -> tuple[list, bool] | None:
+    """
+    Получает результаты поиска из кэша вместе с признаком "пора обновить"
+    (запись старше мягкого TTL). Сначала проверяется кэш в памяти, затем search_cache в БД.
+    """
+    entry = _search_lru.get(query_hash)
+    if entry is not None:
+        search_cache_stats['memory_hits'] += 1
+        return entry[0], _is_search_stale(entry[1])
+
+    db = await get_db()
+    async with db.execute(
+        'SELECT results, timestamp FROM search_cache WHERE query_hash = ?',
+        (query_hash,)
+    ) as cursor:
+        row = await cursor.fetchone()
+    if row:
+        results, timestamp = row
+        if time.time() - timestamp < SEARCH_HARD_TTL:
+            try:
+                decoded = decode_results(results)
+                _remember_search(query_hash, decoded, timestamp)
+                search_cache_stats['db_hits'] += 1
+                return decoded, _is_search_stale(timestamp)
+            except Exception as e:
+                print(f"Поврежденная запись кэша поиска {query_hash}: {e}")
+        await _execute_write('DELETE FROM search_cache WHERE query_hash = ?', (query_hash,))
+    search_cache_stats['misses'] += 1
     return None
 
 async def save_search_to_cache(query_hash: str, results: list):
-    """Сохраняет результаты поиска в кэш БД."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            'INSERT OR REPLACE INTO search_cache (query_hash, results, timestamp) VALUES (?, ?, ?)',
-            (query_hash, json.dumps(results), int(time.time()))
-        )
-        await db.commit()
+    """Сохраняет уже отфильтрованные по длительности результаты поиска в кэш."""
+    timestamp = int(time.time())
+    _remember_search(query_hash, results, timestamp)
+    await _execute_write(
+        'INSERT OR REPLACE INTO search_cache (query_hash, results, timestamp) VALUES (?, ?, ?)',
+        (query_hash, encode_results(results), timestamp)
+    )
+
+async def migrate_search_cache():
+    """Перекодирует записи кэша поиска, сохраненные в старом JSON-формате."""
+    db = await get_db()
+    async with db.execute("SELECT query_hash, results FROM search_cache WHERE typeof(results) = 'text'") as cursor:
+        legacy_rows = await cursor.fetchall()
+    migrated = []
+    for query_hash, results in legacy_rows:
+        if not is_legacy(results):
+            continue
+        try:
+            migrated.append((encode_results(decode_results(results)), query_hash))
+        except Exception as e:
+            print(f"Не удалось перекодировать запись кэша поиска {query_hash}: {e}")
+    if migrated:
+        async with _write_lock:
+            await db.executemany('UPDATE search_cache SET results = ? WHERE query_hash = ?', migrated)
+            await db.commit()
+        print(f"🗄️ Кэш поиска: {len(migrated)} записей переведено в бинарный формат.")
 
 async def cleanup_expired_cache():
-    """Периодическая очистка устаревшего кэша поиска в БД."""
-    cutoff_time = int(time.time()) - CACHE_TTL
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute('DELETE FROM search_cache WHERE timestamp < ?', (cutoff_time,))
-        await db.commit()
-        if cursor.rowcount > 0:
-            print(f"🧹 Очистка кэша поиска: удалено {cursor.rowcount} устаревших записей.")
+    """Периодическая очистка кэша поиска старше жесткого TTL в памяти и в БД."""
+    _search_lru.expire()
+    cutoff_time = int(time.time()) - SEARCH_HARD_TTL
+    cursor = await _execute_write('DELETE FROM search_cache WHERE timestamp < ?', (cutoff_time,))
+    if cursor.rowcount > 0:
+        print(f"🧹 Очистка кэша поиска: удалено {cursor.rowcount} устаревших записей.")
+    stats = get_search_cache_stats()
+    print(f"📊 Кэш поиска: память {stats['memory_hits']}, БД {stats['db_hits']}, промахи {stats['misses']}, "
+          f"устаревшие {stats['stale_hits']} "
+          f"(hit rate {stats['hit_rate']:.0%}, {stats['memory_entries']} записей, {stats['memory_bytes'] // 1024} КБ)")
 
 # --- НОВЫЕ ФУНКЦИИ: для кэша ссылок SoundCloud ---
+# Ссылки живут столько же, сколько кэш поиска, кнопки которого на них ссылаются
 
 async def save_soundcloud_url(url_hash: str, full_url: str):
-    """Сохраняет соответствие хэша и полной ссылки SoundCloud в БД."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            'INSERT OR REPLACE INTO soundcloud_urls (url_hash, full_url, timestamp) VALUES (?, ?, ?)',
-            (url_hash, full_url, int(time.time()))
-        )
-        await db.commit()
+    """Ставит соответствие хэша и полной ссылки SoundCloud в буфер записи."""
+    _pending_soundcloud_urls[url_hash] = (full_url, int(time.time()))
+    if len(_pending_soundcloud_urls) >= WRITE_BATCH_SIZE:
+        await flush_pending_writes()
 
 async def get_soundcloud_url(url_hash: str) -> str | None:
     """Получает полную ссылку SoundCloud по хэшу, если она не устарела."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            'SELECT full_url, timestamp FROM soundcloud_urls WHERE url_hash = ?',
-            (url_hash,)
-        ) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                full_url, timestamp = row
-                if time.time() - timestamp < CACHE_TTL:
-                    return full_url
-                else:
-                    # Ссылка устарела, удаляем ее
-                    await db.execute('DELETE FROM soundcloud_urls WHERE url_hash = ?', (url_hash,))
-                    await db.commit()
+    pending = _pending_soundcloud_urls.get(url_hash)
+    if pending and time.time() - pending[1] < SEARCH_HARD_TTL:
+        return pending[0]
+
+    db = await get_db()
+    async with db.execute(
+        'SELECT full_url, timestamp FROM soundcloud_urls WHERE url_hash = ?',
+        (url_hash,)
+    ) as cursor:
+        row = await cursor.fetchone()
+    if row:
+        full_url, timestamp = row
+        if time.time() - timestamp < SEARCH_HARD_TTL:
+            return full_url
+        else:
+            # Ссылка устарела, удаляем ее
+            await _execute_write('DELETE FROM soundcloud_urls WHERE url_hash = ?', (url_hash,))
     return None
 
 async def cleanup_expired_soundcloud_urls():
     """Периодическая очистка устаревших ссылок SoundCloud в БД."""
-    cutoff_time = int(time.time()) - CACHE_TTL
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute('DELETE FROM soundcloud_urls WHERE timestamp < ?', (cutoff_time,))
-        await db.commit()
-        if cursor.rowcount > 0:
-            print(f"🧹 Очистка ссылок SoundCloud: удалено {cursor.rowcount} устаревших записей.")
\ No newline at end of file
+    cutoff_time = int(time.time()) - SEARCH_HARD_TTL
+    cursor = await _execute_write('DELETE FROM soundcloud_urls WHERE timestamp < ?', (cutoff_time,))
+    if cursor.rowcount > 0:
+        print(f"🧹 Очистка ссылок SoundCloud: удалено {cursor.rowcount} устаревших записей.")
+
+# --- Кэш file_id отправленных треков ---
+
+async def save_telegram_file(track_key: str, file_id: str, info: dict):
+    """Запоминает file_id трека, отправленного в Telegram, вместе с его метаданными."""
+    _pending_telegram_files[track_key] = (
+        file_id, info.get('title'), info.get('artist'), info.get('duration'), int(time.time())
+    )
+    if len(_pending_telegram_files) >= WRITE_BATCH_SIZE:
+        await flush_pending_writes()
+
+async def get_telegram_file(track_key: str) -> dict | None:
+    """Возвращает file_id и метаданные ранее отправленного трека."""
+    row = _pending_telegram_files.get(track_key)
+    if row is None:
+        db = await get_db()
+        async with db.execute(
+            'SELECT file_id, title, artist, duration, timestamp FROM telegram_files WHERE track_key = ?',
+            (track_key,)
+        ) as cursor:
+            row = await cursor.fetchone()
+    if not row:
+        return None
+    file_id, title, artist, duration, _timestamp = row
+    return {'file_id': file_id, 'title': title, 'artist': artist, 'duration': duration}
+
+async def delete_telegram_file(track_key: str):
+    """Удаляет file_id, который Telegram больше не принимает."""
+    _pending_telegram_files.pop(track_key, None)
+    await _execute_write('DELETE FROM telegram_files WHERE track_key = ?', (track_key,))
@@ -4,13 +4,20 @@ from typing import Tuple, Optional
 import traceback
 from aiogram import Bot
 from aiogram.exceptions import TelegramBadRequest, TelegramAPIError
-from aiogram.types import BufferedInputFile, URLInputFile
+from aiogram.types import BufferedInputFile, URLInputFile, FSInputFile
 from cachetools import TTLCache
 
-from download_functions.database import get_user_daily_downloads, save_user_track, cleanup_expired_cache
+from download_functions.database import (
+    get_user_daily_downloads, save_user_track, cleanup_expired_cache,
+    get_telegram_file, save_telegram_file, delete_telegram_file
+)
 from download_functions.yt_download import download_track_optimized, sanitize_filename
 from download_functions.saavn_api import download_track_saavn
 from download_functions.yandex_music_api import download_track_yandex
+from download_functions.audio_cache import get_cached_audio, save_audio_to_cache, is_audio_cached
+from download_functions.circuit_breaker import is_source_open
+from download_functions.prefetcher import claim_prefetch
+from download_functions.worker_pool import SourceWorkerPool, get_worker_pool
 
 import base64
 from download_functions.soundcloud_api import get_soundcloud_info 
@@ -30,27 +37,34 @@ DOWNLOAD_STATUS_UPDATE_INTERVAL = 12
 # --- ЛИМИТЫ КОНТЕНТА ---
 MAX_DURATION_SECONDS = 900  # 15 минут максимум
 
-FAST_QUEUE_MAX_SIZE = 200
-SLOW_QUEUE_MAX_SIZE = 50
-
 # Приоритеты: 0 - самый высокий
 PRIORITY_PREMIUM = 0
 PRIORITY_NORMAL = 1
 
-# Очереди для разных типов задач. Используем PriorityQueue.
-# Элемент в очереди будет кортежем: (priority, timestamp, (call, source, track_id))
-fast_queue = asyncio.PriorityQueue(maxsize=FAST_QUEUE_MAX_SIZE)
-slow_queue = asyncio.PriorityQueue(maxsize=SLOW_QUEUE_MAX_SIZE)
+# Очереди и воркеры у каждого источника свои: см. worker_pool.SourceWorkerPool
 
-ESTIMATED_TIME_PER_SOURCE = {
-    'fast': 15,  # секунд на обработку одного трека в быстрой очереди
-    'slow': 45,  # секунд на обработку одного трека в медленной очереди
-}
+SOURCE_ICONS = {'yandex': '💛', 'saavn': '💛', 'soundcloud': '☁️', 'yt': '📮'}
 
 # --- СОСТОЯНИЯ В ПАМЯТИ ---
 downloading_users = set()
 user_last_search = TTLCache(maxsize=10000, ttl=SEARCH_COOLDOWN)
 subscription_cache = TTLCache(maxsize=5000, ttl=300)
+# Что известно о треках из показанных результатов поиска: track_key -> title/artist/duration
+shown_track_info = TTLCache(maxsize=20000, ttl=7200)
+# Треки, задача на которые уже стоит в очереди или выполняется: track_key -> присоединившиеся call.
+# Скачивает только поставивший задачу, остальные получают его результат. Список едет
+# в самой задаче: воркер работает со своим списком, даже если по ключу уже зарегистрирована новая задача
+download_waiters: dict[str, list] = {}
+download_dedup_stats = {'jobs': 0, 'coalesced': 0}
+
+def remember_shown_tracks(tracks: list):
+    """Запоминает метаданные треков со страницы результатов, чтобы скачивание их не запрашивало заново."""
+    for track in tracks:
+        shown_track_info[f"{track.get('source', 'yt')}_{track.get('id')}"] = {
+            'title': track.get('title'),
+            'artist': track.get('artist'),
+            'duration': track.get('duration'),
+        }
 
 
 async def check_subscription(bot: Bot, user_id: int, channel_id: str) -> bool:
@@ -69,10 +83,12 @@ async def check_subscription(bot: Bot, user_id: int, channel_id: str) -> bool:
         return False
 
 # <<< ИЗМЕНЕНИЕ: Логика проверки лимитов переработана для поддержки новых очередей >>>
-async def check_all_limits(bot: Bot, user_id: int, source: str) -> Tuple[bool, str, int, bool]:
+async def check_all_limits(bot: Bot, user_id: int, source: str, track_id: str) -> Tuple[bool, str, bool]:
     """
     Проверяет все лимиты и возвращает:
-    (возможность скачивания, сообщение для пользователя, позиция в очереди, является ли пользователь премиум)
+    (возможность скачивания, сообщение для пользователя, является ли пользователь премиум).
+    При успехе сообщение — только предупреждение об источнике (или пустая строка):
+    позицию в очереди сообщают после постановки задачи, см. format_queue_message.
     """
     main_sub_task = asyncio.create_task(check_subscription(bot, user_id, CHANNEL_ID_1))
     premium_sub_task = asyncio.create_task(check_subscription(bot, user_id, CHANNEL_ID_2))
@@ -83,10 +99,10 @@ async def check_all_limits(bot: Bot, user_id: int, source: str) -> Tuple[bool, s
     if not is_subscribed_main:
         message = (f"🤨Для использования бота необходимо подписаться на канал: {CHANNEL_ID_1}\n\n"
                    "После подписки нажми на кнопку скачивания еще раз🔄")
-        return False, message, 0, False
+        return False, message, False
 
     if user_id in downloading_users:
-        return False, "👉👈Пожалуйста, подожди, пока завершится предыдущая загрузка...", 0, False
+        return False, "👉👈Пожалуйста, подожди, пока завершится предыдущая загрузка...", False
 
     is_subscribed_premium = await premium_sub_task
     downloads_today = await downloads_task
@@ -97,32 +113,51 @@ async def check_all_limits(bot: Bot, user_id: int, source: str) -> Tuple[bool, s
         message = (f"💀Ты достиг дневного лимита в {current_limit} треков. Лимит обновляется раз в 24 часа...")
         if not is_subscribed_premium and CHANNEL_ID_2:
             message += f"\n\n✨Чтобы увеличить лимит до {PREMIUM_DOWNLOAD_LIMIT} треков, подпишись на: {CHANNEL_ID_2}"
-        return False, message, 0, is_subscribed_premium
-
-    # Определяем, в какую очередь пойдет задача
-    target_queue = slow_queue if source == 'yandex' else fast_queue
-    queue_type = 'slow' if source == 'yandex' else 'fast'
-    
-    # Проверяем, не переполнена ли очередь
-    if target_queue.full():
-        return False, "😥Сервер сейчас перегружен. Пожалуйста, попробуй скачать трек через минуту.", 0, is_subscribed_premium
+        return False, message, is_subscribed_premium
+
+    # У каждого источника своя очередь; проверяем, не переполнена ли она
+    if get_worker_pool(source).queue.full():
+        return False, "😥Сервер сейчас перегружен. Пожалуйста, попробуй скачать трек через минуту.", is_subscribed_premium
+
+    notice = ""
+    # Источник сейчас не отвечает: предупреждаем, но не отказываем — трек может уже быть
+    # в Telegram или в кэше на диске, а пробный запрос к источнику может пройти
+    if (is_source_open(source) and not is_audio_cached(source, track_id)
+            and not await get_telegram_file(f"{source}_{track_id}")):
+        notice = ("\n🛠Этот источник сейчас не отвечает, загрузка может не получиться. "
+                  "Если так — выбери трек из другого источника.")
+
+    return True, notice, is_subscribed_premium
+
+def format_queue_message(source: str, queue_position: int, is_premium: bool) -> str:
+    """Сообщение о постановке в очередь с примерным ожиданием (по замеренному времени обработки источника)."""
+    est_wait_min = int(get_worker_pool(source).estimate_wait(queue_position) // 60)
+    wait_message = f"Примерное время ожидания: ~{est_wait_min} мин." if est_wait_min > 0 else ""
+    premium_status_msg = " (VIP-приоритет ✨)" if is_premium else ""
+    return (f"✅Ты добавлен в очередь{premium_status_msg}.\n"
+            f"Позиция: {queue_position}. {wait_message}")
+
+def join_pending_download(source: str, track_id: str, call) -> bool:
+    """Присоединяет call к задаче на тот же трек, если она уже есть. Возвращает, удалось ли."""
+    waiters = download_waiters.get(f"{source}_{track_id}")
+    if waiters is None:
+        return False
+    waiters.append(call)
+    download_dedup_stats['coalesced'] += 1
+    return True
 
-    queue_position = target_queue.qsize() + 1
-    
-    # Собираем информативное сообщение
-    est_wait_seconds = queue_position * ESTIMATED_TIME_PER_SOURCE[queue_type]
-    est_wait_min = int(est_wait_seconds // 60)
-    
-    wait_message = ""
-    if est_wait_min > 0:
-        wait_message = f"Примерное время ожидания: ~{est_wait_min} мин."
+def register_download_job(source: str, track_id: str, waiters: list):
+    """
+    Открывает задачу для присоединения. Вызывать сразу после неудачного join_pending_download,
+    без await между ними, иначе одновременные нажатия на трек поставят две задачи.
+    """
+    download_waiters[f"{source}_{track_id}"] = waiters
+    download_dedup_stats['jobs'] += 1
 
-    premium_status_msg = " (VIP-приоритет ✨)" if is_subscribed_premium else ""
-    
-    message = (f"✅Ты добавлен в очередь{premium_status_msg}.\n"
-               f"Позиция: {queue_position}. {wait_message}")
-               
-    return True, message, queue_position, is_subscribed_premium
+def _close_download_job(track_key: str, waiters: list):
+    """Закрывает задачу для новых присоединений — только свою, а не более новую по тому же ключу."""
+    if download_waiters.get(track_key) is waiters:
+        del download_waiters[track_key]
 
 def check_search_rate_limit(user_id: int) -> Optional[str]:
     if user_id in user_last_search:
@@ -134,7 +169,66 @@ def check_search_rate_limit(user_id: int) -> Optional[str]:
 def is_duration_valid(duration: int) -> bool:
     return 0 < duration <= MAX_DURATION_SECONDS
 
-async def download_worker(bot: Bot, queue: asyncio.PriorityQueue, worker_id: str):
+def build_audio_caption(source: str, full_title: str) -> str:
+    return f"{SOURCE_ICONS.get(source, '🎧')} `{full_title}`"
+
+async def send_cached_audio(bot: Bot, user_id: int, source: str, track_key: str, cached: dict) -> bool:
+    """
+    Отправляет трек по сохраненному file_id, без скачивания и загрузки файла.
+    Возвращает False, если file_id больше не действителен.
+    """
+    full_title = f"{cached.get('artist') or 'Unknown Artist'} - {cached.get('title') or 'Unknown Title'}"
+    try:
+        await bot.send_audio(
+            chat_id=user_id,
+            audio=cached['file_id'],
+            caption=build_audio_caption(source, full_title),
+            parse_mode="Markdown",
+            title=cached.get('title'),
+            performer=cached.get('artist'),
+            duration=int(cached['duration']) if cached.get('duration') else None,
+        )
+        return True
+    except TelegramBadRequest as e:
+        print(f"Cached file_id for {track_key} was rejected: {e}")
+        await delete_telegram_file(track_key)
+        return False
+
+async def edit_job_status(call, waiters: list, text: str):
+    """Обновляет статус у поставившего задачу и у всех, кто ждет тот же трек."""
+    await call.message.edit_text(text)
+    for waiter in list(waiters):
+        try:
+            await waiter.message.edit_text(text)
+        except TelegramAPIError:
+            pass
+
+async def deliver_to_waiters(bot: Bot, source: str, track_key: str, waiters: list, cached: dict):
+    """Отправляет готовый трек по file_id всем присоединившимся к задаче, каждому отдельным сообщением."""
+    _close_download_job(track_key, waiters)
+    delivering = list(waiters)
+    waiters.clear()
+    for waiter in delivering:
+        waiter_id = waiter.from_user.id
+        try:
+            if cached.get('file_id') and await send_cached_audio(bot, waiter_id, source, track_key, cached):
+                await waiter.message.delete()
+                await save_user_track(waiter_id, track_key, cached)
+            else:
+                await waiter.message.edit_text("❌ Не удалось отправить трек. Попробуй скачать его еще раз.")
+        except TelegramAPIError as e:
+            print(f"Failed to deliver {track_key} to waiter {waiter_id}: {e}")
+        finally:
+            downloading_users.discard(waiter_id)
+
+def release_waiters(track_key: str, waiters: list):
+    """Снимает задачу: присоединившиеся, которым ничего не отправили, могут скачивать снова."""
+    _close_download_job(track_key, waiters)
+    for waiter in waiters:
+        downloading_users.discard(waiter.from_user.id)
+    waiters.clear()
+
+async def download_worker(bot: Bot, pool: SourceWorkerPool, worker_id: str):
     print(f"🔧Воркер скачиваний #{worker_id} запущен...")
     
     PROXY_URL = os.getenv('PROXY_URL')
@@ -142,13 +236,35 @@ async def download_worker(bot: Bot, queue: asyncio.PriorityQueue, worker_id: str
         print("CRITICAL ERROR: PROXY_URL is not set in .env file! Bot will not work.")
         return
 
+    queue = pool.queue
     while True:
+        # Простаивающий воркер пул может снять прямо здесь, в ожидании задачи
+        _priority, _timestamp, (call, source, track_id, waiters) = await queue.get()
+        pool.job_started(worker_id)
+        # Трек дошел до пользователя — по этому пул считает долю ошибок источника
+        delivered = False
         try:
-            _priority, _timestamp, (call, source, track_id) = await queue.get()
+            # Временный файл скачанного трека, если его не удалось перенести в кэш
+            temp_audio_path = None
+            track_key = None
             user_id = call.from_user.id
             print(f"[Worker {worker_id}] Processing {track_id} ({source}) for {user_id}")
 
-            await call.message.edit_text("🚀 Готовлю ссылку...")
+            track_key = f"{source}_{track_id}"
+            await edit_job_status(call, waiters, "🚀 Готовлю ссылку...")
+
+            # Трек уже отправлялся кому-то: пересылаем по file_id без скачивания
+            cached_file = await get_telegram_file(track_key)
+            if cached_file and await send_cached_audio(bot, user_id, source, track_key, cached_file):
+                await call.message.delete()
+                await save_user_track(user_id, track_key, cached_file)
+                await deliver_to_waiters(bot, source, track_key, waiters, cached_file)
+                delivered = True
+                print(f"[Worker {worker_id}] Success: Sent cached file_id for {track_key}")
+                continue
+
+            # Если трек уже предзагружается в фоне, дожидаемся его, а не качаем второй раз
+            await claim_prefetch(track_key)
 
             info = None
             audio_source = None 
@@ -182,27 +298,39 @@ async def download_worker(bot: Bot, queue: asyncio.PriorityQueue, worker_id: str
                     audio_source = URLInputFile(proxy_link, filename=file_name)
                     print(f"[Worker {worker_id}] Generated proxy link for SoundCloud: {file_name}")
                 else:
-                    await call.message.edit_text("❌ Не удалось получить информацию о треке с SoundCloud.")
+                    await edit_job_status(call, waiters, "❌ Не удалось получить информацию о треке с SoundCloud.")
                     continue # Переходим к следующей задаче в очереди
 
-            # Логика для других источников (yandex, saavn, yt) остается без изменений
+            # Для остальных источников (yandex, saavn, yt) сначала смотрим в дисковый кэш
             else:
-                if source == 'yandex': info = await download_track_yandex(track_id)
-                elif source == 'saavn': info = await download_track_saavn(track_id)
-                else: info = await download_track_optimized(track_id)
-
+                info = await get_cached_audio(source, track_id)
                 if not info:
-                    await call.message.edit_text("❌ Не удалось скачать трек. Возможно, он недоступен.")
-                    continue
-
-                if 'audio_bytes' in info:
+                    if source == 'yandex': downloaded = await download_track_yandex(track_id)
+                    elif source == 'saavn': downloaded = await download_track_saavn(track_id)
+                    else: downloaded = await download_track_optimized(track_id, known=shown_track_info.get(track_key))
+
+                    if not downloaded:
+                        await edit_job_status(call, waiters, "❌ Не удалось скачать трек. Возможно, он недоступен.")
+                        continue
+                    # Трек переезжает в кэш и дальше отдается с диска по частям
+                    info = await save_audio_to_cache(source, track_id, downloaded)
+                    if not info:
+                        info = downloaded
+                        temp_audio_path = downloaded.get('audio_path')
+
+                if 'audio_path' in info:
+                    full_title = f"{info.get('artist') or 'Unknown Artist'} - {info.get('title') or 'Unknown Title'}"
+                    file_name = f"{sanitize_filename(full_title)}.{info.get('extension', 'm4a')}"
+                    # Файл читается с диска по частям во время загрузки, без копии в памяти
+                    audio_source = FSInputFile(info['audio_path'], filename=file_name)
+                elif 'audio_bytes' in info:
                     full_title = f"{info.get('artist', 'Unknown Artist')} - {info.get('title', 'Unknown Title')}"
                     file_extension = info.get('extension', 'm4a')
                     file_name = f"{sanitize_filename(full_title)}.{file_extension}"
                     audio_source = BufferedInputFile(info['audio_bytes'], filename=file_name)
 
             if not audio_source:
-                await call.message.edit_text("❌ Внутренняя ошибка: источник аудио не определен.")
+                await edit_job_status(call, waiters, "❌ Внутренняя ошибка: источник аудио не определен.")
                 continue
 
             # ... (остальная часть функции: подготовка метаданных, отправка)
@@ -216,14 +344,15 @@ async def download_worker(bot: Bot, queue: asyncio.PriorityQueue, worker_id: str
                 thumbnail = URLInputFile(info.get('thumbnail_url'))
             elif info.get('thumbnail_bytes'):
                 thumbnail = BufferedInputFile(info.get('thumbnail_bytes'), 'thumb.jpg')
+            elif info.get('thumbnail_path'):
+                thumbnail = FSInputFile(info['thumbnail_path'], filename='thumb.jpg')
 
-            source_icons = {'yandex': '💛', 'saavn': '💛', 'soundcloud': '☁️', 'yt': '📮'}
             # Используем full_title, который мы определили ранее
-            caption = f"{source_icons.get(source, '🎧')} `{full_title}`"
+            caption = build_audio_caption(source, full_title)
             
-            await call.message.edit_text("✅ Отправляю...")
+            await edit_job_status(call, waiters, "✅ Отправляю...")
             
-            await bot.send_audio(
+            sent_message = await bot.send_audio(
                 chat_id=user_id,
                 audio=audio_source, # audio_source уже содержит filename
                 caption=caption,
@@ -234,20 +363,33 @@ async def download_worker(bot: Bot, queue: asyncio.PriorityQueue, worker_id: str
                 thumbnail=thumbnail
             )
             await call.message.delete()
-            await save_user_track(user_id, f"{source}_{track_id}", info)
+            if sent_message.audio:
+                await save_telegram_file(track_key, sent_message.audio.file_id, info)
+            await save_user_track(user_id, track_key, info)
+            delivered = True
             print(f"[Worker {worker_id}] Success: Sent {full_title} from {source}")
+            # Остальным ждавшим этот трек — уже загруженный в Telegram файл, без повторного скачивания
+            await deliver_to_waiters(bot, source, track_key, waiters, {
+                'file_id': sent_message.audio.file_id if sent_message.audio else None,
+                'title': title, 'artist': artist, 'duration': duration,
+            })
 
         except Exception as e:
             print(f"[Worker {worker_id}] Critical error in worker: {e}")
             traceback.print_exc()
             if 'call' in locals():
                 try:
-                    await call.message.edit_text("❌ Произошла непредвиденная ошибка при обработке вашего запроса.")
+                    await edit_job_status(call, waiters, "❌ Произошла непредвиденная ошибка при обработке вашего запроса.")
                 except:
                     pass
         finally:
+            if temp_audio_path and os.path.exists(temp_audio_path):
+                os.unlink(temp_audio_path)
+            if track_key:
+                release_waiters(track_key, waiters)
             if 'user_id' in locals() and user_id in downloading_users:
                 downloading_users.remove(user_id)
+            pool.job_finished(worker_id, delivered)
             queue.task_done()
 
 async def start_periodic_db_cleanup():
@@ -0,0 +1,183 @@
+import asyncio
+import os
+import time
+from collections import deque
+from dotenv import load_dotenv
+
+from download_functions.audio_cache import is_audio_cached, save_audio_to_cache
+from download_functions.circuit_breaker import is_source_open, set_speculative
+from download_functions.database import get_telegram_file
+from download_functions.scheduler import set_task_priority, track_slot_acquired, PRIORITY_BACKGROUND
+from download_functions.yt_download import download_track_optimized, resolve_track_optimized
+from download_functions.saavn_api import download_track_saavn
+from download_functions.yandex_music_api import download_track_yandex
+from download_functions.soundcloud_api import get_soundcloud_info
+
+load_dotenv()
+
+# 'off' — выключено, 'resolve' — заранее разбирать страницы YouTube/SoundCloud,
+# 'download' — вдобавок скачивать YouTube/Saavn/Яндекс в дисковый кэш аудио
+PREFETCH_MODE = os.getenv('PREFETCH_MODE', 'resolve').lower()
+PREFETCH_TOP_K = int(os.getenv('PREFETCH_TOP_K', 2))
+# Бюджеты: одновременных предзагрузок всего и на пользователя, скачанных байт в час
+PREFETCH_MAX_INFLIGHT = int(os.getenv('PREFETCH_MAX_INFLIGHT', 4))
+PREFETCH_MAX_PER_USER = int(os.getenv('PREFETCH_MAX_PER_USER', 2))
+PREFETCH_MAX_BYTES_PER_HOUR = int(os.getenv('PREFETCH_MAX_BYTES_PER_HOUR', 500 * 1024 ** 2))
+# Сколько предзагруженный трек ждет нажатия, прежде чем считаться напрасным
+PREFETCH_TTL = 1800
+# Сколько воркер ждет уже начатую предзагрузку, прежде чем скачать трек сам, с
+PREFETCH_CLAIM_TIMEOUT = float(os.getenv('PREFETCH_CLAIM_TIMEOUT', 15))
+
+RESOLVE_SOURCES = {'yt', 'soundcloud'}
+DOWNLOAD_SOURCES = {'yt', 'saavn', 'yandex'}
+
+# Идущие предзагрузки: track_key -> задача
+_inflight: dict[str, asyncio.Task] = {}
+# Выставляется, когда предзагрузка получила слот источника и начала запрос
+_upstream_started: dict[str, asyncio.Event] = {}
+_user_inflight: dict[int, int] = {}
+# Готовые предзагрузки, которых еще никто не скачал: track_key -> (время, байт)
+_prefetched: dict[str, tuple[float, int]] = {}
+_bytes_window = deque()  # (время, байт) скачанного за последний час
+prefetch_stats = {
+    'scheduled': 0, 'completed': 0, 'failed': 0, 'skipped_budget': 0,
+    'hits': 0, 'downloads': 0, 'wasted': 0, 'bytes': 0, 'wasted_bytes': 0,
+    'cancelled': 0, 'claim_timeouts': 0,
+}
+
+
+def _track_target(track: dict) -> tuple[str, str]:
+    """(источник, track_id) так же, как их получит download_worker."""
+    source = track.get('source', 'yt')
+    if source == 'soundcloud':
+        return source, track.get('url')
+    return source, track.get('id')
+
+def _bytes_last_hour() -> int:
+    now = time.monotonic()
+    while _bytes_window and now - _bytes_window[0][0] > 3600:
+        _bytes_window.popleft()
+    return sum(size for _, size in _bytes_window)
+
+def _expire_prefetched():
+    """Предзагрузки, которые так и не понадобились, засчитываются как напрасные."""
+    now = time.monotonic()
+    for track_key, (done_at, size) in list(_prefetched.items()):
+        if now - done_at > PREFETCH_TTL:
+            del _prefetched[track_key]
+            prefetch_stats['wasted'] += 1
+            prefetch_stats['wasted_bytes'] += size
+
+def _finish_prefetch(track_key: str, user_id: int):
+    # Колбэк завершения, а не finally: задача, отмененная до первого шага, свой код не выполняет
+    _inflight.pop(track_key, None)
+    _upstream_started.pop(track_key, None)
+    _user_inflight[user_id] -= 1
+    if not _user_inflight[user_id]:
+        del _user_inflight[user_id]
+
+async def _prefetch(source: str, track_id: str, known: dict):
+    track_key = f"{source}_{track_id}"
+    # Предзагрузка уступает слоты источников поиску и настоящим скачиваниям,
+    # а ее сбои не размыкают предохранители: источник проверяют только запросы пользователей
+    set_task_priority(PRIORITY_BACKGROUND)
+    set_speculative()
+    _upstream_started[track_key] = track_slot_acquired()
+    # Временный файл скачанного трека, если его не удалось перенести в кэш
+    temp_audio_path = None
+    try:
+        # Уже отправлялся в Telegram — нажатие и так будет мгновенным
+        if await get_telegram_file(track_key):
+            return
+        size = 0
+        if PREFETCH_MODE == 'download' and source in DOWNLOAD_SOURCES:
+            if source == 'yandex': downloaded = await download_track_yandex(track_id)
+            elif source == 'saavn': downloaded = await download_track_saavn(track_id)
+            else: downloaded = await download_track_optimized(track_id, known=known)
+            cached = await save_audio_to_cache(source, track_id, downloaded) if downloaded else None
+            if not cached:
+                if downloaded:
+                    temp_audio_path = downloaded.get('audio_path')
+                prefetch_stats['failed'] += 1
+                return
+            size = os.path.getsize(cached['audio_path'])
+            _bytes_window.append((time.monotonic(), size))
+        elif source == 'yt':
+            if not await resolve_track_optimized(track_id):
+                prefetch_stats['failed'] += 1
+                return
+        else:
+            if not await get_soundcloud_info(track_id):
+                prefetch_stats['failed'] += 1
+                return
+        _prefetched[track_key] = (time.monotonic(), size)
+        prefetch_stats['completed'] += 1
+        prefetch_stats['bytes'] += size
+    except Exception as e:
+        prefetch_stats['failed'] += 1
+        print(f"Prefetch error for {track_key}: {e}")
+    finally:
+        if temp_audio_path and os.path.exists(temp_audio_path):
+            os.unlink(temp_audio_path)
+
+def schedule_prefetch(user_id: int, results: list, min_score: int):
+    """
+    Запускает в фоне предзагрузку первых PREFETCH_TOP_K треков с оценкой не ниже min_score,
+    пока пользователь выбирает. Лишнее отбрасывается по бюджетам, а не ставится в очередь.
+    """
+    if PREFETCH_MODE not in ('resolve', 'download'):
+        return
+    _expire_prefetched()
+    sources = RESOLVE_SOURCES | (DOWNLOAD_SOURCES if PREFETCH_MODE == 'download' else set())
+    for track in results[:PREFETCH_TOP_K]:
+        if track.get('relevance_score', 0) < min_score:
+            break
+        source, track_id = _track_target(track)
+        track_key = f"{source}_{track_id}"
+        if not track_id or source not in sources or is_source_open(source):
+            continue
+        if track_key in _inflight or track_key in _prefetched or is_audio_cached(source, track_id):
+            continue
+        if (len(_inflight) >= PREFETCH_MAX_INFLIGHT
+                or _user_inflight.get(user_id, 0) >= PREFETCH_MAX_PER_USER
+                or (PREFETCH_MODE == 'download' and _bytes_last_hour() >= PREFETCH_MAX_BYTES_PER_HOUR)):
+            prefetch_stats['skipped_budget'] += 1
+            break
+        known = {'title': track.get('title'), 'artist': track.get('artist'), 'duration': track.get('duration')}
+        _user_inflight[user_id] = _user_inflight.get(user_id, 0) + 1
+        task = asyncio.create_task(_prefetch(source, track_id, known))
+        task.add_done_callback(lambda _task, track_key=track_key, user_id=user_id: _finish_prefetch(track_key, user_id))
+        _inflight[track_key] = task
+        prefetch_stats['scheduled'] += 1
+
+async def claim_prefetch(track_key: str):
+    """
+    Вызывается воркером перед скачиванием: дожидается идущей предзагрузки этого трека
+    (вместо второго такого же запроса) и учитывает попадание.
+    Предзагрузка, которая еще ждет слот с фоновым приоритетом, отменяется — воркер
+    скачает сам с приоритетом скачивания. Начатую ждем не дольше PREFETCH_CLAIM_TIMEOUT.
+    """
+    prefetch_stats['downloads'] += 1
+    task = _inflight.get(track_key)
+    if task:
+        started = _upstream_started.get(track_key)
+        if not started or not started.is_set():
+            task.cancel()
+            prefetch_stats['cancelled'] += 1
+        else:
+            try:
+                await asyncio.wait_for(asyncio.shield(task), PREFETCH_CLAIM_TIMEOUT)
+            except asyncio.TimeoutError:
+                prefetch_stats['claim_timeouts'] += 1
+                print(f"Prefetch of {track_key} is still running after {PREFETCH_CLAIM_TIMEOUT:g}s, downloading directly.")
+    if _prefetched.pop(track_key, None) is not None:
+        prefetch_stats['hits'] += 1
+
+def get_prefetch_stats() -> dict:
+    _expire_prefetched()
+    stats = dict(prefetch_stats)
+    used = stats['hits'] + stats['wasted']
+    stats['hit_rate'] = stats['hits'] / used if used else 0.0
+    stats['coverage'] = stats['hits'] / stats['downloads'] if stats['downloads'] else 0.0
+    stats['inflight'] = len(_inflight)
+    return stats
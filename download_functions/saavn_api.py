@@ -1,9 +1,55 @@
 import asyncio
 import aiohttp
 import io
+import os
+
+from download_functions.circuit_breaker import get_breaker, SourceRejected, SourceFailed
+from download_functions.scheduler import source_slot, PRIORITY_SEARCH, PRIORITY_DOWNLOAD
 
 API_BASE_URL = "https://saavn.dev/api" # Основной URL API
 
+# Пул соединений: API и CDN с аудио — разные хосты, поэтому лимит и на хост, и общий
+SAAVN_MAX_CONNECTIONS = int(os.getenv('SAAVN_MAX_CONNECTIONS', 20))
+SAAVN_MAX_CONNECTIONS_PER_HOST = int(os.getenv('SAAVN_MAX_CONNECTIONS_PER_HOST', 8))
+SAAVN_DNS_CACHE_TTL = 300
+SAAVN_KEEPALIVE_TIMEOUT = 30
+SAAVN_CONNECT_TIMEOUT = 5
+
+session: aiohttp.ClientSession = None
+
+
+async def init_saavn_session():
+    """Создает общую сессию Saavn с keep-alive соединениями и кэшем DNS."""
+    global session
+    if session and not session.closed:
+        return
+    connector = aiohttp.TCPConnector(
+        limit=SAAVN_MAX_CONNECTIONS,
+        limit_per_host=SAAVN_MAX_CONNECTIONS_PER_HOST,
+        ttl_dns_cache=SAAVN_DNS_CACHE_TTL,
+        keepalive_timeout=SAAVN_KEEPALIVE_TIMEOUT,
+    )
+    # Общий таймаут задается на каждый запрос, здесь — только на установку соединения
+    session = aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=None, connect=SAAVN_CONNECT_TIMEOUT),
+    )
+    print("✅ Сессия Saavn создана.")
+
+async def get_saavn_session() -> aiohttp.ClientSession:
+    """Возвращает общую сессию, создавая ее при первом обращении (если вызов был до on_startup)."""
+    if not session or session.closed:
+        await init_saavn_session()
+    return session
+
+async def close_saavn_session():
+    """Закрывает общую сессию при завершении работы."""
+    global session
+    if session and not session.closed:
+        await session.close()
+        print("Сессия Saavn закрыта")
+    session = None
+
 async def search_tracks_saavn(query: str, limit: int = 20) -> list[dict]:
     """
     Ищет треки через API Saavn.
@@ -11,36 +57,45 @@ async def search_tracks_saavn(query: str, limit: int = 20) -> list[dict]:
     """
     search_url = f"{API_BASE_URL}/search/songs"
     params = {"query": query, "limit": limit}
+    breaker = get_breaker('saavn')
+    if not breaker.allow_request():
+        raise SourceRejected('saavn')
     
     results = []
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(search_url, params=params, timeout=10) as response:
-                if response.status != 200:
-                    print(f"Saavn API search error: HTTP {response.status}")
-                    return []
-                
-                data = await response.json()
-                if not data.get('success') or not data['data'].get('results'):
-                    return []
-                
-                for track in data['data']['results']:
-                    # Пропускаем треки без URL для скачивания
-                    if not track.get('downloadUrl'):
-                        continue
-
-                    # Формируем стандартизированный результат
-                    results.append({
-                        'id': track['id'],
-                        'title': track['name'],
-                        'artist': ', '.join([artist['name'] for artist in track.get('artists', {}).get('primary', [])]),
-                        'duration': int(track.get('duration', 0)),
-                        'source': 'saavn',  # Указываем источник
-                        'thumbnail_url': track['image'][-1]['url'] # Берем самое высокое качество
-                    })
+        session = await get_saavn_session()
+        async with source_slot('saavn', PRIORITY_SEARCH), \
+                session.get(search_url, params=params, timeout=aiohttp.ClientTimeout(total=10)) as response:
+            if response.status != 200:
+                print(f"Saavn API search error: HTTP {response.status}")
+                breaker.record_failure()
+                raise SourceFailed(f"HTTP {response.status}")
+            
+            data = await response.json()
+            breaker.record_success()
+            if not data.get('success') or not data['data'].get('results'):
+                return []
+            
+            for track in data['data']['results']:
+                # Пропускаем треки без URL для скачивания
+                if not track.get('downloadUrl'):
+                    continue
+
+                # Формируем стандартизированный результат
+                results.append({
+                    'id': track['id'],
+                    'title': track['name'],
+                    'artist': ', '.join([artist['name'] for artist in track.get('artists', {}).get('primary', [])]),
+                    'duration': int(track.get('duration', 0)),
+                    'source': 'saavn',  # Указываем источник
+                    'thumbnail_url': track['image'][-1]['url'] # Берем самое высокое качество
+                })
+    except SourceFailed:
+        raise
     except Exception as e:
         print(f"An error occurred during Saavn search: {e}")
-        return []
+        breaker.record_failure()
+        raise SourceFailed(str(e)) from e
         
     return results
 
@@ -60,48 +115,58 @@ def _get_best_download_link(download_urls: list) -> str | None:
                 best_link = link
     return best_link
 
+async def _fetch_bytes(session: aiohttp.ClientSession, url: str, timeout: float) -> tuple[int, bytes | None]:
+    """GET с чтением тела; ответ закрывается сразу, чтобы соединение вернулось в пул."""
+    async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+        if response.status != 200:
+            return response.status, None
+        return response.status, await response.read()
 
 async def download_track_saavn(song_id: str) -> dict | None:
     """
     Скачивает трек по ID из Saavn API, включая аудио и обложку.
     """
     song_details_url = f"{API_BASE_URL}/songs/{song_id}"
+    breaker = get_breaker('saavn')
+    if not breaker.allow_request():
+        print(f"Saavn is unavailable (circuit open), skipping download of {song_id}")
+        return None
     
-    try:
-        async with aiohttp.ClientSession() as session:
+    # Весь цикл скачивания занимает один слот источника
+    async with source_slot('saavn', PRIORITY_DOWNLOAD):
+        try:
+            session = await get_saavn_session()
             # 1. Получаем детали трека, включая ссылки на скачивание
-            async with session.get(song_details_url, timeout=10) as response:
+            async with session.get(song_details_url, timeout=aiohttp.ClientTimeout(total=10)) as response:
                 if response.status != 200:
                     print(f"Saavn API song details error: HTTP {response.status}")
+                    breaker.record_failure()
                     return None
-                
+            
                 data = await response.json()
                 if not data.get('success') or not data['data']:
                     return None
-            
+        
             song_data = data['data'][0]
             download_url = _get_best_download_link(song_data.get('downloadUrl', []))
-            
+        
             if not download_url:
                 print(f"No download URL found for song {song_id}")
                 return None
 
-            # 2. Асинхронно скачиваем аудиофайл и обложку
-            audio_task = asyncio.create_task(session.get(download_url, timeout=60))
+            # 2. Параллельно скачиваем аудиофайл и обложку через соединения из пула
             thumbnail_url = song_data['image'][-1]['url']
-            thumbnail_task = asyncio.create_task(session.get(thumbnail_url, timeout=15))
-
-            audio_response, thumbnail_response = await asyncio.gather(audio_task, thumbnail_task)
+            (audio_status, audio_bytes), (_thumbnail_status, thumbnail_bytes) = await asyncio.gather(
+                _fetch_bytes(session, download_url, 60),
+                _fetch_bytes(session, thumbnail_url, 15),
+            )
 
             # 3. Обрабатываем результаты
-            if audio_response.status != 200:
-                print(f"Failed to download audio from {download_url}")
+            if not audio_bytes:
+                print(f"Failed to download audio from {download_url}: HTTP {audio_status}")
+                breaker.record_failure()
                 return None
-            audio_bytes = await audio_response.read()
-
-            thumbnail_bytes = None
-            if thumbnail_response.status == 200:
-                thumbnail_bytes = await thumbnail_response.read()
+            breaker.record_success()
 
             return {
                 'audio_bytes': audio_bytes,
@@ -112,6 +177,7 @@ async def download_track_saavn(song_id: str) -> dict | None:
                 'thumbnail_bytes': thumbnail_bytes
             }
             
-    except Exception as e:
-        print(f"An error occurred during Saavn download: {e}")
-        return None
\ No newline at end of file
+        except Exception as e:
+            print(f"An error occurred during Saavn download: {e}")
+            breaker.record_failure()
+            return None
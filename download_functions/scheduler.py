@@ -0,0 +1,188 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Приоритеты запросов к источнику: меньше — раньше получает свободный слот
+PRIORITY_SEARCH = 0      # Пользователь ждет результаты поиска
+PRIORITY_DOWNLOAD = 1    # Скачивание из очереди воркеров
+PRIORITY_BACKGROUND = 2  # Фоновые задачи, которые никто не ждет
+
+# Нижняя граница приоритета для текущей задачи: фоновая задача не должна
+# занимать слоты с приоритетом поиска или скачивания, даже вызывая те же функции
+_priority_floor = contextvars.ContextVar('priority_floor', default=PRIORITY_SEARCH)
+# Событие, которое выставляется, когда текущая задача впервые получает слот источника
+_slot_acquired = contextvars.ContextVar('slot_acquired', default=None)
+
+# Сколько запросов к источнику выполняется одновременно. Переопределяется через SOURCE_CONCURRENCY_<SOURCE>.
+DEFAULT_SOURCE_CONCURRENCY = {
+    'yandex': 2,
+    'saavn': 8,
+    'yt': int(os.getenv('YOUTUBE_SEMAPHORE_LIMIT', 4)),
+    'soundcloud': 4,
+}
+SOURCE_CONCURRENCY = {
+    source: int(os.getenv(f'SOURCE_CONCURRENCY_{source.upper()}', limit))
+    for source, limit in DEFAULT_SOURCE_CONCURRENCY.items()
+}
+FALLBACK_SOURCE_CONCURRENCY = 4
+
+# Не больше стольких новых запросов в секунду (0 — без ограничения). Через SOURCE_RATE_<SOURCE>.
+SOURCE_RATES = {
+    source: float(os.getenv(f'SOURCE_RATE_{source.upper()}', 0))
+    for source in DEFAULT_SOURCE_CONCURRENCY
+}
+
+
+class SourceLimiter:
+    """
+    Ограничитель одного источника: не больше concurrency запросов одновременно
+    и не больше rate запусков в секунду. Освободившийся слот достается
+    ожидающему с наименьшим приоритетом, при равенстве — пришедшему раньше.
+    """
+
+    def __init__(self, source: str, concurrency: int, rate: float = 0):
+        self.source = source
+        self.concurrency = concurrency
+        self.rate = rate
+        self.active = 0
+        self._waiters = []  # куча (приоритет, порядковый номер, future)
+        self._order = itertools.count()
+        self._next_start = 0.0
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.peak_waiting = 0
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def acquire(self, priority: int = PRIORITY_SEARCH):
+        started = time.monotonic()
+        if self.active < self.concurrency and not self.waiting:
+            self.active += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._order), future))
+            self.peak_waiting = max(self.peak_waiting, self.waiting)
+            try:
+                # release() передает слот напрямую, не уменьшая active
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self.release()
+                raise
+
+        if self.rate:
+            now = time.monotonic()
+            start_at = max(now, self._next_start)
+            self._next_start = start_at + 1 / self.rate
+            if start_at > now:
+                try:
+                    await asyncio.sleep(start_at - now)
+                except asyncio.CancelledError:
+                    self.release()
+                    raise
+
+        self.acquired += 1
+        self.total_wait += time.monotonic() - started
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def as_dict(self) -> dict:
+        return {
+            'active': self.active,
+            'limit': self.concurrency,
+            'waiting': self.waiting,
+            'peak_waiting': self.peak_waiting,
+            'acquired': self.acquired,
+            'avg_wait': self.total_wait / self.acquired if self.acquired else 0.0,
+            'rate': self.rate,
+        }
+
+
+class SlotLease:
+    """
+    Занятый слот источника. Обычно освобождается при выходе из source_slot, но если
+    работа ушла в исполнитель (поток или процесс), слот держится до ее завершения:
+    отмена ожидающей корутины не останавливает yt-dlp, и слот не должен освободиться раньше.
+    """
+
+    def __init__(self, limiter: SourceLimiter):
+        self._limiter = limiter
+        self._handed_off = False
+        self._released = False
+
+    def release_when_done(self, future: asyncio.Future):
+        """Передает освобождение слота future (одна передача на один source_slot)."""
+        self._handed_off = True
+        future.add_done_callback(lambda _future: self._release())
+
+    def _release(self):
+        if not self._released:
+            self._released = True
+            self._limiter.release()
+
+
+limiters: dict[str, SourceLimiter] = {}
+
+
+def get_limiter(source: str) -> SourceLimiter:
+    if source not in limiters:
+        limiters[source] = SourceLimiter(
+            source,
+            SOURCE_CONCURRENCY.get(source, FALLBACK_SOURCE_CONCURRENCY),
+            SOURCE_RATES.get(source, 0),
+        )
+    return limiters[source]
+
+def set_task_priority(priority: int):
+    """Понижает приоритет всех обращений к источникам из текущей задачи asyncio."""
+    _priority_floor.set(priority)
+
+def track_slot_acquired() -> asyncio.Event:
+    """Событие, которое выставится, когда текущая задача asyncio получит слот какого-либо источника."""
+    event = asyncio.Event()
+    _slot_acquired.set(event)
+    return event
+
+@asynccontextmanager
+async def source_slot(source: str, priority: int = PRIORITY_SEARCH):
+    """
+    Занимает слот источника на время блока async with. Блок получает SlotLease:
+    его передают в extract_info / run_blocking, чтобы слот держался до конца работы в исполнителе.
+    """
+    limiter = get_limiter(source)
+    await limiter.acquire(max(priority, _priority_floor.get()))
+    acquired = _slot_acquired.get()
+    if acquired:
+        acquired.set()
+    lease = SlotLease(limiter)
+    try:
+        yield lease
+    finally:
+        if not lease._handed_off:
+            lease._release()
+
+def get_scheduler_stats() -> dict:
+    return {source: limiter.as_dict() for source, limiter in limiters.items()}
+
+def format_scheduler_stats() -> str:
+    """Короткая сводка по занятости источников для логов."""
+    return "\n".join(
+        f"{source}: занято {stats['active']}/{stats['limit']}, ждут {stats['waiting']} "
+        f"(пик {stats['peak_waiting']}), выдано {stats['acquired']}, среднее ожидание {stats['avg_wait']:.2f}s"
+        for source, stats in get_scheduler_stats().items()
+    )
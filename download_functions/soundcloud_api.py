@@ -1,8 +1,28 @@
 # soundcloud_api.py
-import asyncio
-import yt_dlp
 import traceback
 import aiohttp
+from cachetools import TTLCache
+
+from download_functions.circuit_breaker import get_breaker, SourceRejected, SourceFailed
+from download_functions.ydl_pool import get_ydl_pool, extract_info, is_source_failure
+from download_functions.scheduler import source_slot, PRIORITY_SEARCH, PRIORITY_DOWNLOAD
+
+# Опции для получения информации о треке
+INFO_YDL_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'format': 'bestaudio/best', # Важно, чтобы yt-dlp выбрал лучший аудиоформат
+}
+SEARCH_YDL_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': True,
+    'default_search': 'scsearch',
+}
+INFO_YDL_POOL = get_ydl_pool('soundcloud_info', INFO_YDL_OPTS)
+# Информация о треке, уже полученная (в том числе предзагрузкой): URL страницы -> info
+soundcloud_info_cache = TTLCache(maxsize=1000, ttl=1800)
+SEARCH_YDL_POOL = get_ydl_pool('soundcloud_search', SEARCH_YDL_OPTS)
 
 async def get_soundcloud_info(track_url: str) -> dict | None:
     """
@@ -12,21 +32,18 @@ async def get_soundcloud_info(track_url: str) -> dict | None:
     if not track_url or not track_url.startswith('http'):
         print(f"SoundCloud info error: Invalid URL received: '{track_url}'")
         return None
-
-    loop = asyncio.get_event_loop()
-    # Опции для получения информации
-    ydl_opts = {
-        'quiet': True,
-        'no_warnings': True,
-        'format': 'bestaudio/best', # Важно, чтобы yt-dlp выбрал лучший аудиоформат
-    }
+    if track_url in soundcloud_info_cache:
+        return soundcloud_info_cache[track_url]
+    breaker = get_breaker('soundcloud')
+    if not breaker.allow_request():
+        print(f"SoundCloud is unavailable (circuit open), skipping {track_url}")
+        return None
 
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # Получаем полную информацию, не скачивая
-            info_dict = await loop.run_in_executor(
-                None, lambda: ydl.extract_info(track_url, download=False)
-            )
+        # Получаем полную информацию, не скачивая
+        async with source_slot('soundcloud', PRIORITY_DOWNLOAD) as slot:
+            info_dict = await extract_info(INFO_YDL_POOL, track_url, slot=slot)
+        breaker.record_success()
 
         if not info_dict:
             return None
@@ -43,7 +60,7 @@ async def get_soundcloud_info(track_url: str) -> dict | None:
             title = title[len(artist) + 3:]
 
         # Собираем все в один словарь
-        return {
+        info = {
             'webpage_url': info_dict.get('webpage_url', track_url),
             'artist': artist,
             'title': title,
@@ -51,48 +68,54 @@ async def get_soundcloud_info(track_url: str) -> dict | None:
             'thumbnail_url': info_dict.get('thumbnail'),
             'ext': info_dict.get('ext', 'mp3'), # Очень важное поле!
         }
+        soundcloud_info_cache[track_url] = info
+        return info
 
     except Exception as e:
         print(f"Failed to get SoundCloud stream info for {track_url}: {e}")
         traceback.print_exc()
+        # Удаленный или приватный трек — не сбой SoundCloud
+        if is_source_failure(e):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
         return None
 
 # Функции поиска остаются без изменений, просто убедитесь, что они есть
 # (я скопировал вашу функцию поиска из исходного кода для полноты)
 async def search_tracks_soundcloud(query: str, limit: int = 10) -> list:
     """Ищет треки на SoundCloud с помощью yt-dlp."""
-    loop = asyncio.get_event_loop()
-    YDL_OPTS_INFO = {
-        'quiet': True,
-        'no_warnings': True,
-        'extract_flat': True,
-        'default_search': 'scsearch',
-    }
-    with yt_dlp.YoutubeDL(YDL_OPTS_INFO) as ydl:
-        try:
-            search_query = f"scsearch{limit}:{query}"
-            search_result = await loop.run_in_executor(
-                None, lambda: ydl.extract_info(search_query, download=False)
-            )
-            tracks = []
-            if 'entries' in search_result:
-                for entry in search_result['entries']:
-                    if entry and entry.get('duration'):
-                        artist = entry.get('uploader') or "Unknown Artist"
-                        title = entry.get('title') or "Unknown Title"
-                        if title.lower().startswith(artist.lower() + ' - '):
-                            title = title[len(artist) + 3:]
-                        tracks.append({
-                            'id': entry['id'], 
-                            'url': entry.get('webpage_url') or entry.get('url'),
-                            'source': 'soundcloud',
-                            'title': title,
-                            'artist': artist,
-                            'duration': entry.get('duration'),
-                            'thumbnail_url': entry.get('thumbnail'),
-                        })
-            return tracks
-        except Exception as e:
-            print(f"SoundCloud search error: {e}")
-            traceback.print_exc()
-            return []
+    breaker = get_breaker('soundcloud')
+    if not breaker.allow_request():
+        raise SourceRejected('soundcloud')
+    try:
+        search_query = f"scsearch{limit}:{query}"
+        async with source_slot('soundcloud', PRIORITY_SEARCH) as slot:
+            search_result = await extract_info(SEARCH_YDL_POOL, search_query, slot=slot)
+        breaker.record_success()
+        tracks = []
+        if 'entries' in search_result:
+            for entry in search_result['entries']:
+                if entry and entry.get('duration'):
+                    artist = entry.get('uploader') or "Unknown Artist"
+                    title = entry.get('title') or "Unknown Title"
+                    if title.lower().startswith(artist.lower() + ' - '):
+                        title = title[len(artist) + 3:]
+                    tracks.append({
+                        'id': entry['id'], 
+                        'url': entry.get('webpage_url') or entry.get('url'),
+                        'source': 'soundcloud',
+                        'title': title,
+                        'artist': artist,
+                        'duration': entry.get('duration'),
+                        'thumbnail_url': entry.get('thumbnail'),
+                    })
+        return tracks
+    except Exception as e:
+        print(f"SoundCloud search error: {e}")
+        traceback.print_exc()
+        if is_source_failure(e):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        raise SourceFailed(str(e)) from e
\ No newline at end of file
@@ -0,0 +1,159 @@
+import asyncio
+import os
+import time
+from collections import deque
+from dotenv import load_dotenv
+
+from download_functions.circuit_breaker import get_breaker, SourceRejected, SourceFailed
+
+load_dotenv()
+
+# Бюджет времени на один поиск в источнике (сек). Переопределяется через SOURCE_TIMEOUT_<SOURCE>.
+DEFAULT_SOURCE_TIMEOUTS = {'yandex': 8, 'saavn': 6, 'yt': 15, 'soundcloud': 12}
+SOURCE_TIMEOUTS = {
+    source: float(os.getenv(f'SOURCE_TIMEOUT_{source.upper()}', timeout))
+    for source, timeout in DEFAULT_SOURCE_TIMEOUTS.items()
+}
+FALLBACK_SOURCE_TIMEOUT = 10
+
+# Источники, в которые отправляется дублирующий запрос, если первый дольше их p95 (через запятую)
+HEDGED_SOURCES = {s.strip() for s in os.getenv('SEARCH_HEDGED_SOURCES', '').split(',') if s.strip()}
+HEDGE_MIN_SAMPLES = 20  # p95 по меньшему числу замеров ненадежен
+
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32)
+LATENCY_WINDOW = 200  # Сколько последних замеров хранить для перцентилей
+
+
+class SourceStats:
+    """Счетчики и гистограмма задержек одного источника."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.hedges = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.recent = deque(maxlen=LATENCY_WINDOW)
+
+    def observe(self, latency: float):
+        self.recent.append(latency)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def percentile(self, fraction: float) -> float | None:
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def as_dict(self) -> dict:
+        # Пропущенные предохранителем вызовы не доходили до источника и в долю ошибок не входят
+        attempts = self.calls - self.rejected
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'rejected': self.rejected,
+            'hedges': self.hedges,
+            'error_rate': (self.errors + self.timeouts) / attempts if attempts else 0.0,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'histogram': dict(zip([f"<={b}s" for b in LATENCY_BUCKETS] + ['>32s'], self.buckets)),
+        }
+
+
+source_stats: dict[str, SourceStats] = {}
+
+
+def _stats_for(source: str) -> SourceStats:
+    if source not in source_stats:
+        source_stats[source] = SourceStats()
+    return source_stats[source]
+
+async def _first_of(primary: asyncio.Task, factory, source: str, stats: SourceStats):
+    """Ждет основной запрос; если он дольше p95 источника, запускает дубль и берет первый ответ."""
+    hedge_delay = stats.percentile(0.95)
+    if source not in HEDGED_SOURCES or hedge_delay is None or len(stats.recent) < HEDGE_MIN_SAMPLES:
+        return await primary
+
+    done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+    if done:
+        return primary.result()
+
+    stats.hedges += 1
+    hedge = asyncio.create_task(factory())
+    tasks = {primary, hedge}
+    try:
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            # Оба запроса могут завершиться разом: сначала ищем удачный среди всех завершившихся
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+            # Ошибка одного из запросов не страшна, пока второй еще может ответить
+            if not tasks:
+                return next(iter(done)).result()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def run_source(source: str, factory) -> list:
+    """
+    Выполняет поиск в источнике в рамках его бюджета времени.
+    factory() должна возвращать новую корутину поиска (нужно для дублирующего запроса).
+    Просроченный или упавший поиск дает пустой список, а не ошибку
+    и засчитывается предохранителю источника. Функции поиска сообщают об исходе
+    исключениями SourceRejected (запроса не было) и SourceFailed (ошибка уже учтена предохранителем).
+    """
+    stats = _stats_for(source)
+    stats.calls += 1
+    timeout = SOURCE_TIMEOUTS.get(source, FALLBACK_SOURCE_TIMEOUT)
+    started = time.monotonic()
+    primary = asyncio.create_task(factory())
+    try:
+        result = await asyncio.wait_for(_first_of(primary, factory, source, stats), timeout=timeout)
+    except SourceRejected:
+        # Мгновенный отказ без запроса не должен занижать задержки и p95 для дублирующих запросов
+        stats.rejected += 1
+        return []
+    except SourceFailed:
+        # Функция поиска уже записала ошибку в лог и в предохранитель
+        stats.errors += 1
+        stats.observe(time.monotonic() - started)
+        return []
+    except asyncio.TimeoutError:
+        stats.timeouts += 1
+        stats.observe(time.monotonic() - started)
+        get_breaker(source).record_failure()
+        print(f"Source {source} exceeded its {timeout:g}s budget, dropping its results.")
+        return []
+    except Exception as e:
+        stats.errors += 1
+        stats.observe(time.monotonic() - started)
+        get_breaker(source).record_failure()
+        print(f"Source {source} failed: {e}")
+        return []
+    finally:
+        primary.cancel()
+    stats.observe(time.monotonic() - started)
+    return result if isinstance(result, list) else []
+
+def get_source_stats() -> dict:
+    return {source: stats.as_dict() for source, stats in source_stats.items()}
+
+def format_source_stats() -> str:
+    """Короткая сводка по источникам для логов."""
+    lines = []
+    for source, stats in get_source_stats().items():
+        p50 = f"{stats['p50']:.2f}s" if stats['p50'] is not None else "-"
+        p95 = f"{stats['p95']:.2f}s" if stats['p95'] is not None else "-"
+        lines.append(
+            f"{source}: {stats['calls']} вызовов, p50 {p50}, p95 {p95}, "
+            f"ошибки {stats['errors']}, таймауты {stats['timeouts']} (всего {stats['error_rate']:.0%}), "
+            f"пропущено {stats['rejected']}, дубли {stats['hedges']}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,221 @@
+import asyncio
+import itertools
+import math
+import os
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Границы числа воркеров скачивания на источник (min, max).
+# Переопределяются через WORKERS_MIN_<SOURCE> / WORKERS_MAX_<SOURCE>.
+DEFAULT_WORKER_BOUNDS = {
+    'yt': (2, 8),
+    'saavn': (1, 6),
+    'soundcloud': (1, 4),
+    'yandex': (1, 3),
+}
+# Размер очереди источника, через WORKER_QUEUE_SIZE_<SOURCE>
+DEFAULT_QUEUE_SIZE = {'yt': 100, 'saavn': 50, 'soundcloud': 50, 'yandex': 50}
+# Время обработки одной задачи, с — стартовая оценка, пока нет замеров
+DEFAULT_SERVICE_TIME = {'yt': 15, 'saavn': 3, 'soundcloud': 5, 'yandex': 45}
+
+# Сколько задача может ждать в очереди, прежде чем добавляются воркеры, с
+WORKER_TARGET_WAIT = float(os.getenv('WORKER_TARGET_WAIT', 20))
+# Как часто пулы пересчитывают число воркеров (рост — еще и при каждой новой задаче), с
+WORKER_SCALE_INTERVAL = float(os.getenv('WORKER_SCALE_INTERVAL', 5))
+# При такой доле неудачных задач пул не растет: источнику не помогут лишние запросы
+WORKER_MAX_ERROR_RATE = float(os.getenv('WORKER_MAX_ERROR_RATE', 0.5))
+# Вес нового замера в скользящих средних времени обработки и доли ошибок
+EWMA_ALPHA = 0.2
+
+# Источник, чьи воркеры обрабатывают задачи неизвестных источников (как раньше быстрая очередь)
+FALLBACK_SOURCE = 'yt'
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+
+class SourceWorkerPool:
+    """
+    Очередь и воркеры скачивания одного источника. Число воркеров держится между
+    min_workers и max_workers: растет, когда очередь не успевает разойтись за
+    WORKER_TARGET_WAIT при наблюдаемом времени обработки, и по одному снимает
+    простаивающих, когда работы меньше. Пока источник в основном отвечает ошибками, не растет.
+    """
+
+    def __init__(self, source: str, min_workers: int, max_workers: int, queue_size: int, service_time: float):
+        self.source = source
+        self.min_workers = min_workers
+        self.max_workers = max(min_workers, max_workers)
+        # Элемент очереди: (priority, timestamp, (call, source, track_id, waiters))
+        self.queue = asyncio.PriorityQueue(maxsize=queue_size)
+        self.service_time = service_time
+        self.error_rate = 0.0
+        self.workers: dict[str, asyncio.Task] = {}
+        self.busy: set[str] = set()
+        self._worker_factory = None
+        self._numbers = itertools.count(1)
+        self._started_at = {}
+        self.halted = False
+        self.jobs = 0
+        self.failures = 0
+        self.scale_ups = 0
+        self.scale_downs = 0
+        self.peak_workers = 0
+        self.busy_seconds = 0.0
+        self.worker_seconds = 0.0
+        self._last_tick = time.monotonic()
+
+    def start(self, worker_factory):
+        """worker_factory(pool, worker_id) возвращает корутину воркера."""
+        self._worker_factory = worker_factory
+        self._last_tick = time.monotonic()
+        self.rescale()
+
+    def _spawn(self):
+        worker_id = f"{self.source}-{next(self._numbers)}"
+        task = asyncio.create_task(self._worker_factory(self, worker_id))
+        task.add_done_callback(lambda done, worker_id=worker_id: self._on_worker_exit(worker_id, done))
+        self.workers[worker_id] = task
+        self.peak_workers = max(self.peak_workers, len(self.workers))
+
+    def _on_worker_exit(self, worker_id: str, task: asyncio.Task):
+        self.workers.pop(worker_id, None)
+        self.busy.discard(worker_id)
+        if not task.cancelled():
+            # Воркер завершился сам (например, без PROXY_URL): не перезапускаем его по кругу
+            self.halted = True
+            print(f"⚠️ Worker {worker_id} exited, pool {self.source} stops spawning workers.")
+
+    def _account_worker_time(self):
+        now = time.monotonic()
+        self.worker_seconds += len(self.workers) * (now - self._last_tick)
+        self._last_tick = now
+
+    def desired_workers(self) -> int:
+        """Сколько воркеров нужно, чтобы очередь разошлась за WORKER_TARGET_WAIT."""
+        backlog_seconds = self.queue.qsize() * self.service_time
+        wanted = len(self.busy) + math.ceil(backlog_seconds / WORKER_TARGET_WAIT)
+        if self.error_rate > WORKER_MAX_ERROR_RATE:
+            wanted = min(wanted, len(self.workers))
+        return max(self.min_workers, min(self.max_workers, wanted))
+
+    def rescale(self, allow_shrink: bool = False):
+        """Догоняет нужное число воркеров сразу, а уменьшает по одному простаивающему за вызов."""
+        if not self._worker_factory or self.halted:
+            return
+        self._account_worker_time()
+        wanted = self.desired_workers()
+        if len(self.workers) < wanted:
+            if self.workers:
+                self.scale_ups += 1
+            while len(self.workers) < wanted:
+                self._spawn()
+        elif allow_shrink and len(self.workers) > wanted:
+            idle = [worker_id for worker_id in self.workers if worker_id not in self.busy]
+            if idle:
+                # Простаивающий воркер ждет в queue.get(): отмена не теряет задач
+                self.workers[idle[-1]].cancel()
+                self.scale_downs += 1
+
+    async def submit(self, item):
+        """Ставит задачу в очередь без ожидания (asyncio.QueueFull, если места нет) и при нужде добавляет воркеров."""
+        self.queue.put_nowait(item)
+        self.rescale()
+
+    def job_started(self, worker_id: str):
+        self.busy.add(worker_id)
+        self._started_at[worker_id] = time.monotonic()
+
+    def job_finished(self, worker_id: str, succeeded: bool):
+        elapsed = time.monotonic() - self._started_at.pop(worker_id, time.monotonic())
+        self.busy.discard(worker_id)
+        self.jobs += 1
+        self.busy_seconds += elapsed
+        self.service_time += EWMA_ALPHA * (elapsed - self.service_time)
+        self.error_rate += EWMA_ALPHA * ((0.0 if succeeded else 1.0) - self.error_rate)
+        if not succeeded:
+            self.failures += 1
+
+    def estimate_wait(self, position: int) -> float:
+        """Примерное ожидание задачи на позиции position в очереди, с."""
+        workers = max(len(self.workers), self.desired_workers(), 1)
+        return math.ceil(position / workers) * self.service_time
+
+    def as_dict(self) -> dict:
+        self._account_worker_time()
+        return {
+            'workers': len(self.workers),
+            'busy': len(self.busy),
+            'min': self.min_workers,
+            'max': self.max_workers,
+            'queued': self.queue.qsize(),
+            'jobs': self.jobs,
+            'failures': self.failures,
+            'service_time': self.service_time,
+            'error_rate': self.error_rate,
+            'utilization': self.busy_seconds / self.worker_seconds if self.worker_seconds else 0.0,
+            'peak_workers': self.peak_workers,
+            'scale_ups': self.scale_ups,
+            'scale_downs': self.scale_downs,
+        }
+
+
+worker_pools: dict[str, SourceWorkerPool] = {}
+_manager_task: asyncio.Task = None
+
+
+def get_worker_pool(source: str) -> SourceWorkerPool:
+    """Пул источника source; задачи неизвестных источников обрабатывает пул FALLBACK_SOURCE."""
+    if source not in DEFAULT_WORKER_BOUNDS:
+        source = FALLBACK_SOURCE
+    if source not in worker_pools:
+        min_workers, max_workers = DEFAULT_WORKER_BOUNDS[source]
+        worker_pools[source] = SourceWorkerPool(
+            source,
+            _env_int(f'WORKERS_MIN_{source.upper()}', min_workers),
+            _env_int(f'WORKERS_MAX_{source.upper()}', max_workers),
+            _env_int(f'WORKER_QUEUE_SIZE_{source.upper()}', DEFAULT_QUEUE_SIZE[source]),
+            DEFAULT_SERVICE_TIME[source],
+        )
+    return worker_pools[source]
+
+async def _manage_worker_pools():
+    while True:
+        await asyncio.sleep(WORKER_SCALE_INTERVAL)
+        for pool in worker_pools.values():
+            pool.rescale(allow_shrink=True)
+
+def start_worker_pools(worker_factory):
+    """Запускает пулы всех источников и фоновый пересчет числа воркеров."""
+    global _manager_task
+    for source in DEFAULT_WORKER_BOUNDS:
+        pool = get_worker_pool(source)
+        pool.start(worker_factory)
+        print(f"🚀Пул {source}: {len(pool.workers)} воркеров (от {pool.min_workers} до {pool.max_workers})")
+    _manager_task = asyncio.create_task(_manage_worker_pools())
+
+def stop_worker_pools():
+    global _manager_task
+    if _manager_task:
+        _manager_task.cancel()
+        _manager_task = None
+    for pool in worker_pools.values():
+        pool.halted = True
+        for task in list(pool.workers.values()):
+            task.cancel()
+
+def get_worker_pool_stats() -> dict:
+    return {source: pool.as_dict() for source, pool in worker_pools.items()}
+
+def format_worker_pool_stats() -> str:
+    """Короткая сводка по пулам воркеров для логов."""
+    return "\n".join(
+        f"{source}: воркеров {stats['workers']} ({stats['min']}-{stats['max']}, пик {stats['peak_workers']}), "
+        f"заняты {stats['busy']}, в очереди {stats['queued']}, загрузка {stats['utilization']:.0%}, "
+        f"задач {stats['jobs']} (ошибок {stats['error_rate']:.0%} сейчас), "
+        f"обработка ~{stats['service_time']:.1f}s, рост {stats['scale_ups']}, сокращений {stats['scale_downs']}"
+        for source, stats in get_worker_pool_stats().items()
+    )
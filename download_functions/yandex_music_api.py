@@ -5,13 +5,14 @@ from yandex_music import ClientAsync
 from dotenv import load_dotenv
 import aiohttp 
 
+from download_functions.circuit_breaker import get_breaker, SourceRejected, SourceFailed
+from download_functions.scheduler import source_slot, PRIORITY_SEARCH, PRIORITY_DOWNLOAD
+
 load_dotenv()
 
 YANDEX_TOKEN = os.getenv('YANDEX_MUSIC_TOKEN')
 client: ClientAsync = None
 
-yandex_api_semaphore = asyncio.Semaphore(2)
-
 
 async def init_yandex_music_client():
     """Инициализирует асинхронный клиент Яндекс.Музыки. (ВАШ ОРИГИНАЛЬНЫЙ, РАБОЧИЙ КОД)"""
@@ -34,15 +35,19 @@ async def init_yandex_music_client():
 
 
 async def search_tracks_yandex(query: str, limit: int = 15) -> list[dict]:
-    """Ищет треки через API Яндекс.Музыки. (ВАШ ОРИГИНАЛЬНЫЙ КОД + СЕМАФОР)"""
+    """Ищет треки через API Яндекс.Музыки. (ВАШ ОРИГИНАЛЬНЫЙ КОД + ЛИМИТ ИСТОЧНИКА)"""
     if not client:
-        return []
+        raise SourceRejected('yandex')
+    breaker = get_breaker('yandex')
+    if not breaker.allow_request():
+        raise SourceRejected('yandex')
 
-    # Оборачиваем вызов в семафор
-    async with yandex_api_semaphore:
+    # Занимаем слот источника в общем планировщике
+    async with source_slot('yandex', PRIORITY_SEARCH):
         try:
             # Ваша логика поиска
             search_result = await client.search(query, type_='track', page=0, nocorrect=False)
+            breaker.record_success()
             if not search_result or not search_result.tracks:
                 return []
 
@@ -64,7 +69,8 @@ async def search_tracks_yandex(query: str, limit: int = 15) -> list[dict]:
             return results
         except Exception as e:
             print(f"An error occurred during Yandex.Music search: {e}")
-            return []
+            breaker.record_failure()
+            raise SourceFailed(str(e)) from e
 
 async def download_with_retry(track, max_retries=3, initial_delay=1):
     """(ВАША ОРИГИНАЛЬНАЯ ФУНКЦИЯ, БЕЗ ИЗМЕНЕНИЙ)"""
@@ -110,12 +116,16 @@ async def download_with_retry(track, max_retries=3, initial_delay=1):
 
 
 async def download_track_yandex(track_album_id: str) -> dict | None:
-    """Скачивает трек по ID из Яндекс.Музыки. (ВАШ ОРИГИНАЛЬНЫЙ КОД + СЕМАФОР)"""
+    """Скачивает трек по ID из Яндекс.Музыки. (ВАШ ОРИГИНАЛЬНЫЙ КОД + ЛИМИТ ИСТОЧНИКА)"""
     if not client:
         print("Клиент Яндекс.Музыки не инициализирован")
         return None
+    breaker = get_breaker('yandex')
+    if not breaker.allow_request():
+        print(f"Яндекс.Музыка недоступна (предохранитель разомкнут), пропускаем {track_album_id}")
+        return None
     
-    async with yandex_api_semaphore:
+    async with source_slot('yandex', PRIORITY_DOWNLOAD):
         try:
             track_id = track_album_id.split(':')[0]
             print(f"Скачиваем трек с ID: {track_id}")
@@ -140,7 +150,9 @@ async def download_track_yandex(track_album_id: str) -> dict | None:
             
             if not audio_bytes:
                 print("Не удалось скачать аудио после всех попыток")
+                breaker.record_failure()
                 return None
+            breaker.record_success()
             
             print(f"Аудио успешно скачано: {len(audio_bytes)} байт")
             
@@ -165,10 +177,12 @@ async def download_track_yandex(track_album_id: str) -> dict | None:
             
         except asyncio.TimeoutError:
             print("Общий таймаут операции скачивания")
+            breaker.record_failure()
             return None
         except Exception as e:
             print(f"An error occurred during Yandex.Music download: {e}")
             traceback.print_exc()
+            breaker.record_failure()
             return None
 
 
@@ -0,0 +1,202 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+
+import yt_dlp
+from yt_dlp.networking.exceptions import HTTPError, TransportError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Сколько готовых экземпляров держать на профиль (лишние закрываются при возврате)
+YDL_POOL_SIZE = int(os.getenv('YDL_POOL_SIZE', 4))
+
+# Где выполняется работа yt-dlp: 'thread' — потоки этого процесса,
+# 'process' — отдельные процессы, чей разбор страниц не держит GIL event loop'а
+YDL_BACKEND = os.getenv('YDL_BACKEND', 'thread').lower()
+YDL_PROCESS_WORKERS = int(os.getenv('YDL_PROCESS_WORKERS', os.cpu_count() or 1))
+
+# Пул потоков для блокирующих вызовов yt-dlp (и для режима 'thread', и для вспомогательной работы)
+thread_executor = ThreadPoolExecutor(max_workers=(os.cpu_count() or 1) * 2)
+_process_executor: ProcessPoolExecutor = None
+
+
+class ExtractionError(Exception):
+    """Ошибка yt-dlp из рабочего процесса (исключения yt-dlp не переносятся между процессами)."""
+
+    def __init__(self, message: str, source_failure: bool = True):
+        # Оба значения в args: так исключение восстанавливается после передачи из процесса
+        super().__init__(message, source_failure)
+        self.source_failure = source_failure
+
+    def __str__(self) -> str:
+        return self.args[0]
+
+
+def is_source_failure(error: BaseException) -> bool:
+    """
+    Виноват ли в ошибке yt-dlp сам источник: сеть, таймаут, ответ 5xx или 429.
+    Недоступное, приватное видео или видео с возрастным ограничением — ошибка
+    конкретного трека, из-за нее предохранитель источника размыкаться не должен.
+    """
+    if isinstance(error, ExtractionError):
+        return error.source_failure
+    seen = set()
+    current = error
+    # yt-dlp заворачивает сетевые ошибки: DownloadError.exc_info -> ExtractorError.cause -> TransportError
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        if isinstance(current, HTTPError):
+            return current.status >= 500 or current.status == 429
+        if isinstance(current, (TransportError, TimeoutError, ConnectionError)):
+            return True
+        exc_info = getattr(current, 'exc_info', None)
+        current = ((exc_info[1] if exc_info else None) or getattr(current, 'cause', None)
+                   or current.__cause__ or current.__context__)
+    return False
+
+
+class YDLPool:
+    """
+    Пул готовых YoutubeDL с одними и теми же опциями.
+    Создание YoutubeDL заново собирает реестр экстракторов и HTTP-опенер —
+    это десятки миллисекунд CPU на каждый поиск. Поток берет экземпляр на время
+    одного вызова extract_info и возвращает его; одновременно экземпляр
+    используется только одним потоком.
+    """
+
+    def __init__(self, name: str, opts: dict, size: int = YDL_POOL_SIZE):
+        self.name = name
+        self.opts = opts
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self.created = 0
+        self.reused = 0
+
+    def _create(self) -> yt_dlp.YoutubeDL:
+        self.created += 1
+        return yt_dlp.YoutubeDL(dict(self.opts))
+
+    def warm(self, count: int = 1):
+        """Заранее создает экземпляры, чтобы первый поиск не платил за инициализацию."""
+        while self._idle.qsize() < min(count, self.size):
+            self._idle.put(self._create())
+
+    @contextmanager
+    def borrow(self):
+        """Выдает экземпляр на время блока with. Вызывать из рабочего потока, не из event loop."""
+        try:
+            ydl = self._idle.get_nowait()
+            self.reused += 1
+        except queue.Empty:
+            ydl = self._create()
+        try:
+            yield ydl
+        finally:
+            # Ошибка извлечения не портит экземпляр: сам yt-dlp обрабатывает им много URL подряд
+            if self._idle.qsize() < self.size:
+                self._idle.put(ydl)
+            else:
+                ydl.close()
+
+    def as_dict(self) -> dict:
+        return {
+            'idle': self._idle.qsize(),
+            'created': self.created,
+            'reused': self.reused,
+        }
+
+
+ydl_pools: dict[str, YDLPool] = {}
+
+
+def get_ydl_pool(name: str, opts: dict, size: int = YDL_POOL_SIZE) -> YDLPool:
+    """Возвращает пул профиля name, создавая его при первом обращении."""
+    if name not in ydl_pools:
+        ydl_pools[name] = YDLPool(name, opts, size)
+    return ydl_pools[name]
+
+def warm_ydl_pools(count: int = 1):
+    """Прогревает все зарегистрированные пулы (блокирующий вызов — запускать через to_thread)."""
+    for pool in ydl_pools.values():
+        pool.warm(count)
+
+def get_ydl_pool_stats() -> dict:
+    return {name: pool.as_dict() for name, pool in ydl_pools.items()}
+
+
+def _extract_in_thread(pool: YDLPool, url: str) -> dict:
+    with pool.borrow() as ydl:
+        return ydl.extract_info(url, download=False)
+
+def _extract_in_process(name: str, opts: dict, url: str) -> dict:
+    """
+    Выполняется в рабочем процессе: у процесса свои пулы (по одному экземпляру
+    на профиль — процесс выполняет одно извлечение за раз). Результат очищается
+    до простых dict/list, чтобы его можно было передать обратно.
+    """
+    try:
+        with get_ydl_pool(name, opts, size=1).borrow() as ydl:
+            return ydl.sanitize_info(ydl.extract_info(url, download=False))
+    except Exception as e:
+        raise ExtractionError(f"{type(e).__name__}: {e}", is_source_failure(e)) from None
+
+def _init_process_worker(profiles: dict):
+    """Прогревает экземпляры всех профилей при старте рабочего процесса."""
+    for name, opts in profiles.items():
+        get_ydl_pool(name, opts, size=1).warm()
+
+async def init_ydl_backend():
+    """Запускает выбранный бэкенд: процессы в режиме 'process', иначе прогревает пулы потоков."""
+    global _process_executor
+    if YDL_BACKEND != 'process':
+        await asyncio.to_thread(warm_ydl_pools)
+        return
+    if _process_executor:
+        return
+    profiles = {name: pool.opts for name, pool in ydl_pools.items()}
+    # spawn: fork процесса с event loop'ом и потоками небезопасен
+    _process_executor = ProcessPoolExecutor(
+        max_workers=YDL_PROCESS_WORKERS,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_process_worker,
+        initargs=(profiles,),
+    )
+    print(f"⚙️ yt-dlp работает в {YDL_PROCESS_WORKERS} отдельных процессах.")
+
+def shutdown_ydl_backend():
+    global _process_executor
+    if _process_executor:
+        _process_executor.shutdown(wait=False, cancel_futures=True)
+        _process_executor = None
+
+async def _await_in_slot(future: asyncio.Future, slot):
+    """
+    Ждет работу в исполнителе. С slot (SlotLease из source_slot) слот источника
+    освобождается, только когда работа действительно закончилась: при отмене ждущего
+    (например, по таймауту run_source) поток или процесс продолжает выполнять yt-dlp.
+    """
+    if slot is None:
+        return await future
+    slot.release_when_done(future)
+    return await asyncio.shield(future)
+
+async def extract_info(pool: YDLPool, url: str, slot=None) -> dict:
+    """extract_info(url, download=False) на экземпляре профиля pool в выбранном бэкенде."""
+    loop = asyncio.get_running_loop()
+    if _process_executor:
+        future = loop.run_in_executor(_process_executor, _extract_in_process, pool.name, pool.opts, url)
+    else:
+        future = loop.run_in_executor(thread_executor, _extract_in_thread, pool, url)
+    return await _await_in_slot(future, slot)
+
+async def run_blocking(func, *args, slot=None):
+    """
+    Выполняет блокирующую функцию в выбранном бэкенде.
+    В режиме 'process' func должна быть функцией уровня модуля, а аргументы и результат — простыми данными.
+    """
+    loop = asyncio.get_running_loop()
+    return await _await_in_slot(loop.run_in_executor(_process_executor or thread_executor, func, *args), slot)
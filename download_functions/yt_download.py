@@ -1,23 +1,19 @@
 import yt_dlp
 import os
 import re
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
-import io
 import tempfile
 import hashlib
 from mutagen.mp4 import MP4, MP4Cover
 from mutagen.easyid3 import EasyID3
 from mutagen.id3 import ID3NoHeaderError, TIT2, TPE1, APIC
+from cachetools import TTLCache
 from dotenv import load_dotenv
 
-load_dotenv()
-
-SEMAPHORE_LIMIT = int(os.getenv('YOUTUBE_SEMAPHORE_LIMIT', 4))
-YOUTUBE_SEMAPHORE = asyncio.Semaphore(SEMAPHORE_LIMIT)
+from download_functions.circuit_breaker import get_breaker, SourceRejected, SourceFailed
+from download_functions.ydl_pool import get_ydl_pool, extract_info, run_blocking, is_source_failure
+from download_functions.scheduler import source_slot, get_limiter, PRIORITY_SEARCH, PRIORITY_DOWNLOAD
 
-# Пул потоков для параллельной обработки I/O-bound задач
-executor = ThreadPoolExecutor(max_workers=(os.cpu_count() or 1) * 2)
+load_dotenv()
 
 def sanitize_filename(filename: str) -> str:
     """Удаляет символы, недопустимые в именах файлов."""
@@ -68,6 +64,14 @@ def get_search_ydl_opts():
         'playlist_items': '1-30',
     }
 
+# Готовые экземпляры YoutubeDL для поиска: по одному на одновременный запрос к YouTube
+SEARCH_YDL_POOL = get_ydl_pool('yt_search', get_search_ydl_opts(), size=get_limiter('yt').concurrency)
+RESOLVE_YDL_POOL = get_ydl_pool('yt_resolve', get_optimized_ydl_opts())
+
+# Заранее разобранные видео (предзагрузка): video_id -> info, готовый для скачивания.
+# Ссылки на потоки YouTube живут несколько часов, полчаса — с запасом.
+resolved_info = TTLCache(maxsize=500, ttl=1800)
+
 def clean_title_advanced(raw_title: str, uploader: str = None) -> tuple[str, str]:
     """Улучшенная очистка названий треков."""
     junk_patterns = [
@@ -107,107 +111,162 @@ def clean_title_advanced(raw_title: str, uploader: str = None) -> tuple[str, str
 
 
 async def search_tracks_optimized(query: str, limit: int = 30) -> list[dict]:
-    """Оптимизированный поиск треков с ограничением через семафор."""
-    def _search():
-        with yt_dlp.YoutubeDL(get_search_ydl_opts()) as ydl:
-            try:
-                info = ydl.extract_info(f"ytsearch{limit}:{query}", download=False)
-                results = []
-                for entry in info.get('entries', []):
-                    if entry and 'id' in entry:
-                        duration = entry.get('duration', 0) or 0
-                        if 0 < duration <= 900: # Ограничение длительности 15 минут
-                            results.append({
-                                'id': entry['id'],
-                                'title': entry.get('title', 'Unknown Title'),
-                                'duration': duration
-                            })
-                return results[:limit]
-            except Exception as e:
-                print(f"Search error in thread: {e}")
-                return []
-
-    # Оборачиваем вызов в семафор
-    async with YOUTUBE_SEMAPHORE:
+    """Оптимизированный поиск треков с ограничением через планировщик источников."""
+    breaker = get_breaker('yt')
+    if not breaker.allow_request():
+        raise SourceRejected('yt')
+
+    async with source_slot('yt', PRIORITY_SEARCH) as slot:
         try:
-            results = await asyncio.get_event_loop().run_in_executor(executor, _search)
+            info = await extract_info(SEARCH_YDL_POOL, f"ytsearch{limit}:{query}", slot=slot)
         except Exception as e:
-            print(f"Semaphore/Executor error during search: {e}")
-            results = []
-    return results
+            print(f"Search error: {e}")
+            if is_source_failure(e):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            raise SourceFailed(str(e)) from e
+    breaker.record_success()
+
+    results = []
+    for entry in info.get('entries', []):
+        if entry and 'id' in entry:
+            duration = entry.get('duration', 0) or 0
+            if 0 < duration <= 900: # Ограничение длительности 15 минут
+                results.append({
+                    'id': entry['id'],
+                    'title': entry.get('title', 'Unknown Title'),
+                    'duration': duration
+                })
+    return results[:limit]
 
-async def download_track_optimized(video_id: str) -> dict | None:
-    """Оптимизированное скачивание трека с ограничением через семафор."""
+def _tag_audio_file(path: str, extension: str, title: str, artist: str):
+    """Записывает теги прямо в файл на диске — mutagen переписывает только заголовок, не весь файл в памяти."""
+    if extension == 'm4a':
+        audio = MP4(path); audio['\xa9nam'] = [title]; audio['\xa9ART'] = [artist]; audio.save()
+    elif extension == 'mp3':
+        try: audio = EasyID3(path)
+        except ID3NoHeaderError: audio = EasyID3()
+        audio['title'] = title; audio['artist'] = artist; audio.save(path)
+
+def _download_audio(video_id: str, known: dict | None = None, resolved: dict | None = None) -> tuple[dict | None, str | None]:
+    """
+    Скачивает трек во временный файл и тегирует его на месте (блокирующая функция для бэкенда yt-dlp).
+    known — то, что уже известно из результатов поиска (длительность, название);
+    resolved — info из resolve_track_optimized: с ним страница видео не разбирается заново.
+    Возвращает (info с 'audio_path', ошибка источника): ошибка — сигнал для предохранителя,
+    а info без ошибки может быть None, если трек не подходит или недоступен.
+    Файл по 'audio_path' переходит вызывающему: его нужно перенести в кэш или удалить.
+    """
+    known = known or {}
+    if (known.get('duration') or 0) > 900:
+        return None, None
     url = f"https://www.youtube.com/watch?v={video_id}"
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.%(ext)s') as temp_file:
+        temp_path = temp_file.name
+    # Нужно только уникальное имя: yt-dlp подставит расширение и создаст свой файл
+    os.unlink(temp_path)
     
-    def _download():
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.%(ext)s') as temp_file:
-            temp_path = temp_file.name
-        
-        output_template = temp_path.replace('.%(ext)s', '.%(ext)s')
-        ydl_opts = get_optimized_ydl_opts(output_template)
-        
-        info = None
-        downloaded_file_path = None
-        
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                pre_info = ydl.extract_info(url, download=False)
-                duration = pre_info.get('duration', 0) or 0
-                if duration > 900:
-                    return None
-                
+    output_template = temp_path.replace('.%(ext)s', '.%(ext)s')
+    ydl_opts = get_optimized_ydl_opts(output_template)
+    # Длительность проверяется фильтром в том же проходе, что и скачивание:
+    # страница, player JS и форматы разбираются один раз
+    ydl_opts['match_filter'] = yt_dlp.utils.match_filter_func('duration <=? 900')
+    
+    info = None
+    downloaded_file_path = None
+    
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = None
+            if resolved:
+                try:
+                    info = ydl.process_ie_result(resolved, download=True)
+                except Exception as e:
+                    print(f"Prefetched info for {video_id} is stale, extracting again: {e}")
+            if info is None:
                 info = ydl.extract_info(url, download=True)
-                file_extension = info.get('ext', 'm4a')
-                downloaded_file_path = temp_path.replace('.%(ext)s', f'.{file_extension}')
+            if not info or (info.get('duration') or 0) > 900:
+                return None, None
+            file_extension = info.get('ext', 'm4a')
+            downloaded_file_path = temp_path.replace('.%(ext)s', f'.{file_extension}')
 
-        except Exception as e:
-            print(f"Download process error: {e}")
-            if downloaded_file_path and os.path.exists(downloaded_file_path): os.unlink(downloaded_file_path)
-            return None
+    except Exception as e:
+        print(f"Download process error: {e}")
+        if downloaded_file_path and os.path.exists(downloaded_file_path): os.unlink(downloaded_file_path)
+        # Недоступное или приватное видео — не сбой YouTube
+        return None, str(e) if is_source_failure(e) else None
 
-        if not info or not os.path.exists(downloaded_file_path):
-            return None
+    if not info or not os.path.exists(downloaded_file_path):
+        return None, None
 
-        try:
-            with open(downloaded_file_path, 'rb') as f:
-                audio_bytes = f.read()
-            
-            if not audio_bytes: return None
-            
-            artist, title = clean_title_advanced(info.get('title', 'Unknown Title'), info.get('uploader'))
-            audio_file_in_memory = io.BytesIO(audio_bytes)
-            file_extension = info.get('ext', 'm4a')
+    try:
+        if not os.path.getsize(downloaded_file_path):
+            os.unlink(downloaded_file_path)
+            return None, None
+        
+        artist, title = clean_title_advanced(info.get('title') or known.get('title') or 'Unknown Title', info.get('uploader'))
+        file_extension = info.get('ext', 'm4a')
 
-            try:
-                if file_extension == 'm4a':
-                    audio = MP4(audio_file_in_memory); audio['\xa9nam'] = [title]; audio['\xa9ART'] = [artist]; audio.save(audio_file_in_memory)
-                elif file_extension == 'mp3':
-                    try: audio = EasyID3(audio_file_in_memory)
-                    except ID3NoHeaderError: audio = EasyID3()
-                    audio['title'] = title; audio['artist'] = artist; audio.save(audio_file_in_memory)
-            except Exception as e:
-                print(f"Could not write metadata for {video_id}: {e}")
-            
-            final_audio_bytes = audio_file_in_memory.getvalue()
-            audio_file_in_memory.close()
-            
-            return {'audio_bytes': final_audio_bytes, 'title': title, 'artist': artist, 'duration': info.get('duration', 0), 'extension': file_extension}
+        try:
+            _tag_audio_file(downloaded_file_path, file_extension, title, artist)
         except Exception as e:
-            print(f"Error processing file in thread: {e}")
-            return None
-        finally:
-            if downloaded_file_path and os.path.exists(downloaded_file_path): os.unlink(downloaded_file_path)
+            print(f"Could not write metadata for {video_id}: {e}")
+        
+        return {'audio_path': downloaded_file_path, 'title': title, 'artist': artist, 'duration': info.get('duration', 0), 'extension': file_extension}, None
+    except Exception as e:
+        print(f"Error processing file in thread: {e}")
+        if os.path.exists(downloaded_file_path): os.unlink(downloaded_file_path)
+        return None, None
+
+async def download_track_optimized(video_id: str, known: dict | None = None) -> dict | None:
+    """
+    Оптимизированное скачивание трека с ограничением через планировщик источников.
+    known — метаданные из результатов поиска: по ним длинный трек отсекается без запроса к YouTube.
+    """
+    breaker = get_breaker('yt')
+    if not breaker.allow_request():
+        print(f"YouTube is unavailable (circuit open), skipping download of {video_id}")
+        return None
 
-    # Оборачиваем вызов в семафор
-    async with YOUTUBE_SEMAPHORE:
+    async with source_slot('yt', PRIORITY_DOWNLOAD) as slot:
         try:
-            result = await asyncio.get_event_loop().run_in_executor(executor, _download)
+            result, error = await run_blocking(_download_audio, video_id, known, resolved_info.pop(video_id, None), slot=slot)
         except Exception as e:
             print(f"Semaphore/Executor error during download: {e}")
-            result = None
+            result, error = None, str(e) if is_source_failure(e) else None
+    if error:
+        breaker.record_failure()
+    elif result:
+        breaker.record_success()
     return result
 
+async def resolve_track_optimized(video_id: str) -> bool:
+    """
+    Разбирает страницу видео заранее, без скачивания (для предзагрузки).
+    Следующий download_track_optimized этого видео начнет сразу со скачивания потока.
+    """
+    if video_id in resolved_info:
+        return True
+    breaker = get_breaker('yt')
+    if not breaker.allow_request():
+        return False
+    async with source_slot('yt', PRIORITY_DOWNLOAD) as slot:
+        try:
+            info = await extract_info(RESOLVE_YDL_POOL, f"https://www.youtube.com/watch?v={video_id}", slot=slot)
+        except Exception as e:
+            print(f"Resolve error for {video_id}: {e}")
+            if is_source_failure(e):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            return False
+    breaker.record_success()
+    if not info or (info.get('duration') or 0) > 900:
+        return False
+    resolved_info[video_id] = info
+    return True
+
 # Алиасы для обратной совместимости
 search_tracks = search_tracks_optimized
 download_track = download_track_optimized
\ No newline at end of file
@@ -3,28 +3,39 @@ import os
 import hashlib
 import re
 import time
+import unicodedata
 from aiogram import Bot, Dispatcher, F, Router
 from aiogram.types import Message, CallbackQuery, InlineKeyboardButton
-from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardMarkup
 from aiogram.enums import ChatType
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.context import FSMContext
+from aiogram.exceptions import TelegramBadRequest, TelegramAPIError
 from dotenv import load_dotenv
 
-from thefuzz import fuzz
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
 
 import download_functions.limitations as limitations
 from download_functions.yt_download import search_tracks_optimized
-from download_functions.saavn_api import search_tracks_saavn
+from download_functions.saavn_api import search_tracks_saavn, init_saavn_session, close_saavn_session
 from download_functions.yandex_music_api import search_tracks_yandex, init_yandex_music_client
 
 from download_functions.database import (
-    init_db, get_cached_search, save_search_to_cache,
+    init_db, close_db, get_cached_search, get_cached_search_entry, save_search_to_cache,
     save_soundcloud_url, get_soundcloud_url,
-    cleanup_expired_cache, cleanup_expired_soundcloud_urls
+    cleanup_expired_cache, cleanup_expired_soundcloud_urls, cleanup_old_downloads
 )
 from download_functions.soundcloud_api import search_tracks_soundcloud
+from download_functions.audio_cache import init_audio_cache
+from download_functions.source_runner import run_source, format_source_stats
+from download_functions.circuit_breaker import is_source_open, format_breaker_states
+from download_functions.ydl_pool import init_ydl_backend, shutdown_ydl_backend
+from download_functions.scheduler import format_scheduler_stats
+from download_functions.prefetcher import schedule_prefetch, get_prefetch_stats
+from download_functions.worker_pool import (
+    get_worker_pool, start_worker_pools, stop_worker_pools, format_worker_pool_stats
+)
 from information import info, support
 
 load_dotenv()
@@ -41,10 +52,71 @@ PAGE_SIZE = 5
 MAX_DURATION_SECONDS = 900
 RELEVANCE_THRESHOLD = 60
 HIGH_CONFIDENCE_THRESHOLD = 88
+# Запросы по исполнителю (гибридный поиск) нужны, только если основные дали
+# меньше стольких кандидатов с оценкой не ниже HIGH_CONFIDENCE_THRESHOLD
+HYBRID_MIN_CONFIDENT = int(os.getenv('HYBRID_MIN_CONFIDENT', 3))
+
+# Общий дедлайн поиска: источники, не успевшие ответить, отбрасываются
+SEARCH_DEADLINE = float(os.getenv('SEARCH_DEADLINE', 30))
+# Минимальный интервал между промежуточными обновлениями сообщения с результатами
+PROGRESSIVE_EDIT_INTERVAL = 1.5
+
+# --- Нормализация запросов ---
+# Транслитерация кириллицы в ключе кэша: "монеточка" и "monetochka" дадут один ключ
+QUERY_TRANSLITERATE = os.getenv('QUERY_TRANSLITERATE', '0') == '1'
+
+# Мусорные слова из названий роликов, которые не влияют на то, какой трек ищут.
+# Снимаются только как оформление: в скобках или в конце запроса после названия
+# хотя бы из QUERY_MIN_TITLE_WORDS слов ("Сплин - Клип", "Moby - Official" не трогаем)
+QUERY_JUNK_WORDS = (
+    r'(?:official\s+(?:music\s+)?video|official\s+audio|official\s+lyric\s+video|lyric\s+video|music\s+video|'
+    r'with\s+lyrics|lyrics|official|hq|hd|4k|1080p|720p|'
+    r'официальный\s+клип|официальное\s+видео|текст\s+песни|клип|караоке)'
+)
+QUERY_BRACKETED_JUNK_PATTERN = re.compile(rf'[\(\[]\s*(?:{QUERY_JUNK_WORDS}\b\s*)+[\)\]]', re.IGNORECASE)
+QUERY_TRAILING_JUNK_PATTERN = re.compile(rf'(?:[\s\-–—|]*\b{QUERY_JUNK_WORDS}\b)+[\s\-–—|]*$', re.IGNORECASE)
+QUERY_TRAILING_SEPARATORS_PATTERN = re.compile(r'[\s\-–—|]+$')
+QUERY_WORD_PATTERN = re.compile(r'[^\s\-–—|]+')
+QUERY_MIN_TITLE_WORDS = 2
+# Пунктуация учитывается только в ключе кэша: в источники уходят "P!nk" и "AC/DC" как есть
+QUERY_PUNCTUATION_PATTERN = re.compile(r"[^\w'&]+")
+QUERY_APOSTROPHES_PATTERN = re.compile(r"['’`]")
+
+CYRILLIC_TO_LATIN = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh',
+    'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o',
+    'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'ts',
+    'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu',
+    'я': 'ya',
+})
+
+def canonicalize_query(query: str) -> str:
+    """
+    Приводит запрос к виду, который уходит в источники: NFKC, без лишних пробелов
+    и без мусора-оформления ("(Official Video)", "[HD]", "... lyrics" в конце после названия).
+    Пунктуация и слова внутри запроса не трогаются.
+    """
+    text = ' '.join(unicodedata.normalize('NFKC', query).split())
+    cleaned = ' '.join(QUERY_BRACKETED_JUNK_PATTERN.sub(' ', text).split())
+    trailing = QUERY_TRAILING_JUNK_PATTERN.search(cleaned)
+    # Короткий запрос вроде "the hd" — это и есть название, а не оформление
+    if trailing and len(QUERY_WORD_PATTERN.findall(cleaned[:trailing.start()])) >= QUERY_MIN_TITLE_WORDS:
+        cleaned = cleaned[:trailing.start()]
+    cleaned = QUERY_TRAILING_SEPARATORS_PATTERN.sub('', ' '.join(cleaned.split()))
+    # Запрос целиком из "мусора" (например, "Lyrics") — оставляем как есть
+    return cleaned or text
+
+def query_cache_key(query: str) -> str:
+    """Строит ключ кэша, не зависящий от регистра, пунктуации и порядка слов."""
+    key = QUERY_PUNCTUATION_PATTERN.sub(' ', canonicalize_query(query)).replace('_', ' ')
+    key = QUERY_APOSTROPHES_PATTERN.sub('', key.casefold())
+    if QUERY_TRANSLITERATE:
+        key = key.translate(CYRILLIC_TO_LATIN)
+    return ' '.join(sorted(key.split()))
 
 def create_query_hash(query: str) -> str:
-    """Создает MD5 хэш из запроса для использования в качестве ключа."""
-    return hashlib.md5(query.lower().encode()).hexdigest()
+    """Создает MD5 хэш из нормализованного запроса для использования в качестве ключа."""
+    return hashlib.md5(query_cache_key(query).encode()).hexdigest()
 
 def filter_tracks_by_duration(tracks: list) -> list:
     """Фильтрует треки по длительности, исключая слишком длинные."""
@@ -55,37 +127,43 @@ def filter_tracks_by_duration(tracks: list) -> list:
             filtered_tracks.append(track)
     return filtered_tracks
 
+# Символы 128-255 выбрасываются перед сравнением, как в thefuzz (force_ascii=True)
+FUZZ_ASCII_TABLE = {i: None for i in range(128, 256)}
+BRACKETS_PATTERN = re.compile(r'[\(\[].*?[\)\]]')
+SOURCE_PRIORITY = {'yandex': 3, 'saavn': 2, 'soundcloud': 2, 'yt': 1}
+
+def _fuzz_process(text: str) -> str:
+    """Нормализует строку так же, как thefuzz перед token_set_ratio."""
+    return default_process(text.translate(FUZZ_ASCII_TABLE))
+
 def score_tracks(query: str, tracks: list) -> list:
-    """Оценивает релевантность каждого трека из списка."""
-    scored_tracks = []
-    normalized_query = query.lower()
-    for track in tracks:
-        artist = track.get('artist', '')
-        title = track.get('title', '')
-        track_string_for_comparison = f"{artist} {title}".lower()
-        relevance_score = fuzz.token_set_ratio(normalized_query, track_string_for_comparison)
-        track['relevance_score'] = relevance_score
-        scored_tracks.append(track)
-    return scored_tracks
+    """Оценивает релевантность каждого трека из списка одним пакетным вызовом RapidFuzz."""
+    normalized_query = _fuzz_process(query.lower())
+    choices = [
+        _fuzz_process(f"{track.get('artist', '')} {track.get('title', '')}".lower())
+        for track in tracks
+    ]
+    for _choice, relevance_score, index in process.extract(
+        normalized_query, choices, scorer=fuzz.token_set_ratio, processor=None, limit=None
+    ):
+        tracks[index]['relevance_score'] = int(round(relevance_score))
+    return tracks
 
 def merge_and_sort_results(query: str, all_results: list) -> list:
     """
     Объединяет результаты, вычисляет релевантность, фильтрует, удаляет дубликаты и сортирует.
     """
-    source_priority = {'yandex': 3, 'saavn': 2, 'soundcloud': 2, 'yt': 1}
     scored_tracks = score_tracks(query, all_results)
 
-    final_candidates = [
-        track for track in scored_tracks
-        if track['relevance_score'] >= RELEVANCE_THRESHOLD
-    ]
-    for track in final_candidates:
-        track['source_priority'] = source_priority.get(track.get('source'), 0)
-
+    # Отбор по порогу, приоритет источника и удаление дубликатов — за один проход
     unique_tracks = {}
-    for track in final_candidates:
-        artist_norm = re.sub(r'[\(\[].*?[\)\]]', '', track.get('artist', '')).strip().lower()
-        title_norm = re.sub(r'[\(\[].*?[\)\]]', '', track.get('title', '')).strip().lower()
+    for track in scored_tracks:
+        if track['relevance_score'] < RELEVANCE_THRESHOLD:
+            continue
+        track['source_priority'] = SOURCE_PRIORITY.get(track.get('source'), 0)
+
+        artist_norm = BRACKETS_PATTERN.sub('', track.get('artist', '')).strip().lower()
+        title_norm = BRACKETS_PATTERN.sub('', track.get('title', '')).strip().lower()
         unique_key = f"{artist_norm} - {title_norm}"
 
         if (unique_key not in unique_tracks or
@@ -98,15 +176,189 @@ def merge_and_sort_results(query: str, all_results: list) -> list:
     final_list.sort(key=lambda x: (x['relevance_score'], x['source_priority']), reverse=True)
     return final_list
 
-async def get_paginated_keyboard(results: list, query_hash: str, page: int = 0):
-    builder = InlineKeyboardBuilder()
-    start_offset = page * PAGE_SIZE
-    end_offset = start_offset + PAGE_SIZE
+def _collect_candidates(result_list: list, candidates: list, seen_unique_ids: set):
+    """Добавляет результаты источника к общему списку, пропуская повторы по (source, id)."""
+    for track in result_list:
+        track_unique_id = f"{track.get('source', 'unknown')}_{track.get('id', 'unknown')}"
+        if track_unique_id not in seen_unique_ids:
+            candidates.append(track)
+            seen_unique_ids.add(track_unique_id)
+
+def hybrid_artist_term(query: str) -> str | None:
+    """Первое слово многословного запроса — возможно, исполнитель; по нему ищем отдельно."""
+    primary_term = query.split()[0]
+    if len(query.split()) > 1 and len(primary_term) > 2:
+        return primary_term
+    return None
+
+def build_source_searches(query: str) -> list:
+    """Список (источник, фабрика корутины поиска) — фабрика нужна run_source для дублирующих запросов."""
+    return [
+        ('yandex', lambda: search_tracks_yandex(query, limit=5)),
+        ('saavn', lambda: search_tracks_saavn(query, limit=5)),
+        ('yt', lambda: search_tracks_optimized(query, limit=10)),
+        ('soundcloud', lambda: search_tracks_soundcloud(query, limit=10)),
+    ]
+
+def build_expansion_searches(query: str) -> list:
+    """Дополнительные запросы по предполагаемому исполнителю (пусто, если запрос однословный)."""
+    primary_term = hybrid_artist_term(query)
+    if not primary_term:
+        return []
+    return [
+        ('yandex', lambda: search_tracks_yandex(primary_term, limit=10)),
+        ('saavn', lambda: search_tracks_saavn(primary_term, limit=10)),
+    ]
+
+# Как часто гибридное расширение действительно понадобилось
+hybrid_search_stats = {'eligible': 0, 'expanded': 0, 'skipped': 0}
+
+async def search_all_sources(query: str, on_progress=None) -> tuple[list, list]:
+    """
+    Ищет трек во всех источниках и возвращает
+    (все релевантные результаты, результаты с допустимой длительностью).
+    Результаты объединяются по мере ответа источников: on_progress(results)
+    вызывается с промежуточным отфильтрованным списком, пока остальные еще ищут.
+    Запросы по исполнителю отправляются, только если основных результатов мало.
+    """
+    def start(searches: list) -> dict:
+        # Источники с разомкнутым предохранителем не опрашиваются и не тратят свой таймаут
+        skipped = {source for source, _ in searches if is_source_open(source)}
+        if skipped:
+            print(f"Search: skipping unavailable source(s) {', '.join(sorted(skipped))}")
+        return {
+            asyncio.create_task(run_source(source, factory)): source
+            for source, factory in searches if source not in skipped
+        }
+
+    primary_tasks = start(build_source_searches(query))
+    expansion = build_expansion_searches(query)
+    if expansion:
+        hybrid_search_stats['eligible'] += 1
+    # Решение о расширении принимается, когда ответили источники, которые оно повторяет
+    expansion_sources = {source for source, _ in expansion}
+    gating_tasks = {task for task, source in primary_tasks.items() if source in expansion_sources}
+
+    pending = set(primary_tasks)
+    combined_all_candidates = []
+    seen_unique_ids = set()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SEARCH_DEADLINE
+
+    try:
+        while pending:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and isinstance(task.result(), list):
+                    _collect_candidates(task.result(), combined_all_candidates, seen_unique_ids)
+
+            partial_results = None
+            if expansion:
+                partial_results = merge_and_sort_results(query, combined_all_candidates)
+                confident = sum(1 for track in partial_results if track['relevance_score'] >= HIGH_CONFIDENCE_THRESHOLD)
+                if confident >= HYBRID_MIN_CONFIDENT:
+                    hybrid_search_stats['skipped'] += 1
+                    expansion = []
+                elif not gating_tasks & pending:
+                    print(f"Hybrid search: only {confident} confident result(s), "
+                          f"using '{hybrid_artist_term(query)}' as a potential artist.")
+                    hybrid_search_stats['expanded'] += 1
+                    pending |= set(start(expansion))
+                    expansion = []
+
+            if on_progress and done and pending and combined_all_candidates:
+                if partial_results is None:
+                    partial_results = merge_and_sort_results(query, combined_all_candidates)
+                await on_progress(filter_tracks_by_duration(partial_results))
+    finally:
+        if pending:
+            print(f"Search deadline: dropped {len(pending)} slow source(s) for '{query}'")
+        for task in pending:
+            task.cancel()
+
+    final_results = merge_and_sort_results(query, combined_all_candidates)
+    return final_results, filter_tracks_by_duration(final_results)
+
+def get_hybrid_search_stats() -> dict:
+    stats = dict(hybrid_search_stats)
+    stats['expansion_rate'] = stats['expanded'] / stats['eligible'] if stats['eligible'] else 0.0
+    return stats
+
+# Идущие поиски: query_hash -> (задача, подписчики на промежуточные результаты).
+# Одновременные запросы с одним ключом ждут одну задачу, а не ищут заново.
+inflight_searches: dict[str, tuple[asyncio.Task, list]] = {}
+single_flight_stats = {'searches': 0, 'coalesced': 0, 'upstream_calls_saved': 0}
+
+async def _search_and_cache(query: str, query_hash: str, listeners: list) -> tuple[list, list]:
+    """Один поиск по всем источникам: промежуточные результаты раздаются всем подписчикам, итог кэшируется."""
+    async def notify(results: list):
+        for listener in list(listeners):
+            try:
+                await listener(results)
+            except Exception as e:
+                print(f"Progress callback error for query '{query}': {e}")
+
+    final_results, final_filtered_results = await search_all_sources(query, on_progress=notify)
+    if final_filtered_results:
+        await prepare_result_buttons(final_filtered_results)
+        await save_search_to_cache(query_hash, final_filtered_results)
+    return final_results, final_filtered_results
+
+def _finish_search(query_hash: str, task: asyncio.Task):
+    if inflight_searches.get(query_hash, (None,))[0] is task:
+        inflight_searches.pop(query_hash)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Search task error for {query_hash}: {task.exception()}")
+
+def _join_search(query: str, query_hash: str) -> tuple[asyncio.Task, list]:
+    """Возвращает идущий поиск по ключу или запускает новый."""
+    inflight = inflight_searches.get(query_hash)
+    if inflight:
+        single_flight_stats['coalesced'] += 1
+        single_flight_stats['upstream_calls_saved'] += len(build_source_searches(query))
+        return inflight
+    listeners = []
+    task = asyncio.create_task(_search_and_cache(query, query_hash, listeners))
+    task.add_done_callback(lambda t: _finish_search(query_hash, t))
+    inflight_searches[query_hash] = (task, listeners)
+    single_flight_stats['searches'] += 1
+    return task, listeners
+
+async def search_single_flight(query: str, query_hash: str, on_progress=None) -> tuple[list, list]:
+    """
+    То же, что search_all_sources, но одновременные вызовы с одним query_hash
+    ждут общий поиск. Результат сразу сохраняется в кэш.
+    """
+    task, listeners = _join_search(query, query_hash)
+    if on_progress:
+        listeners.append(on_progress)
+    try:
+        # shield: отмена одного ожидающего не должна обрывать поиск для остальных
+        return await asyncio.shield(task)
+    finally:
+        if on_progress in listeners:
+            listeners.remove(on_progress)
+
+def schedule_search_refresh(query: str, query_hash: str):
+    """Запускает фоновое обновление записи кэша, если поиск по этому ключу еще не идет."""
+    if query_hash not in inflight_searches:
+        _join_search(query, query_hash)
 
-    for track in results[start_offset:end_offset]:
+def get_single_flight_stats() -> dict:
+    return {**single_flight_stats, 'inflight': len(inflight_searches)}
+
+async def prepare_result_buttons(results: list):
+    """
+    Один раз на набор результатов вычисляет текст и callback_data кнопок
+    и сохраняет длинные ссылки SoundCloud. Поля хранятся в самих треках,
+    поэтому попадают в кэш вместе с результатами.
+    """
+    for track in results:
         source = track.get('source', 'yt')
-        icon_map = {'yandex': '💛', 'saavn': '💛', 'soundcloud': '☁️', 'yt': '📮'}
-        source_icon = icon_map.get(source, '🎧')
+        source_icon = limitations.SOURCE_ICONS.get(source, '🎧')
 
         duration = track.get('duration')
         duration_str = f" ({int(duration) // 60}:{int(duration) % 60:02d})" if duration else ""
@@ -138,20 +390,33 @@ async def get_paginated_keyboard(results: list, query_hash: str, page: int = 0):
                 if len(potential_data.encode('utf-8')) <= 64:
                     callback_data = potential_data
 
-        if callback_data:
-            builder.button(text=button_text, callback_data=callback_data)
+        track['button_text'] = button_text
+        track['callback_data'] = callback_data
+
+async def get_paginated_keyboard(results: list, query_hash: str, page: int = 0):
+    start_offset = page * PAGE_SIZE
+    end_offset = start_offset + PAGE_SIZE
+    page_tracks = results[start_offset:end_offset]
+
+    # Записи кэша, сохраненные до появления готовых кнопок
+    if any('callback_data' not in track for track in page_tracks):
+        await prepare_result_buttons(page_tracks)
+
+    limitations.remember_shown_tracks(page_tracks)
+    inline_keyboard = [
+        [InlineKeyboardButton(text=track['button_text'], callback_data=track['callback_data'])]
+        for track in page_tracks if track['callback_data']
+    ]
 
     nav_buttons = []
     if page > 0:
         nav_buttons.append(InlineKeyboardButton(text="👈", callback_data=f"page:{page-1}:{query_hash}"))
     if end_offset < len(results):
         nav_buttons.append(InlineKeyboardButton(text="👉", callback_data=f"page:{page+1}:{query_hash}"))
-
-    builder.adjust(1)
     if nav_buttons:
-        builder.row(*nav_buttons)
+        inline_keyboard.append(nav_buttons)
 
-    return builder.as_markup()
+    return InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
 
 @main_router.message(F.chat.type == ChatType.PRIVATE, F.text == "/start")
 async def cmd_start(message: Message):
@@ -182,64 +447,67 @@ async def handle_query(message: Message, state: FSMContext):
     if error_message:
         await message.reply(error_message); return
 
-    query = message.text.strip()
+    query = canonicalize_query(message.text)
     if not query or len(query) < 2:
         await message.reply("Минимум 2 символа🤨"); return
 
     query_hash = create_query_hash(query)
     status_message = await message.reply("🔎 Ищу треки...")
 
-    cached_results = await get_cached_search(query_hash)
-    if cached_results:
-        filtered_cached = filter_tracks_by_duration(cached_results)
-        if filtered_cached:
-            print(f"Found in DB cache: {query}")
-            keyboard = await get_paginated_keyboard(filtered_cached, query_hash, page=0)
-            await status_message.edit_text(f"🎧 Найдено {len(filtered_cached)} композиции. Выбери:", reply_markup=keyboard)
+    # В кэш попадают уже отфильтрованные по длительности результаты
+    cached_entry = await get_cached_search_entry(query_hash)
+    if cached_entry and cached_entry[0]:
+        cached_results, is_stale = cached_entry
+        print(f"Found in cache: {query}{' (stale, refreshing)' if is_stale else ''}")
+        if is_stale:
+            # Отдаем устаревшие результаты сразу, а свежие подтянутся в фоне
+            schedule_search_refresh(query, query_hash)
+        keyboard = await get_paginated_keyboard(cached_results, query_hash, page=0)
+        await status_message.edit_text(f"🎧 Найдено {len(cached_results)} композиции. Выбери:", reply_markup=keyboard)
+        schedule_prefetch(message.from_user.id, cached_results, HIGH_CONFIDENCE_THRESHOLD)
+        return
+
+    shown_first_page = None
+    last_progress_edit = 0.0
+
+    async def show_partial_results(results: list):
+        """Показывает первую страницу, как только она готова, не дожидаясь медленных источников."""
+        nonlocal shown_first_page, last_progress_edit
+        if not results:
+            return
+        if len(results) < PAGE_SIZE and results[0]['relevance_score'] < HIGH_CONFIDENCE_THRESHOLD:
+            return
+        if time.monotonic() - last_progress_edit < PROGRESSIVE_EDIT_INTERVAL:
+            return
+        first_page = results[:PAGE_SIZE]
+        page_key = [(track.get('source'), track.get('id')) for track in first_page]
+        if page_key == shown_first_page:
             return
+        # Без кнопок навигации: следующие страницы появятся с финальным обновлением
+        await prepare_result_buttons(first_page)
+        keyboard = await get_paginated_keyboard(first_page, query_hash, page=0)
+        try:
+            await status_message.edit_text("🎧 Уже кое-что нашел. Выбери или подожди, ищу в остальных источниках⏳", reply_markup=keyboard)
+        except TelegramBadRequest:
+            return
+        shown_first_page = page_key
+        last_progress_edit = time.monotonic()
 
     try:
         await status_message.edit_text("🔎 Ищу треки во всех источниках...")
 
-        tasks = [
-            search_tracks_yandex(query, limit=5),
-            search_tracks_saavn(query, limit=5),
-            search_tracks_optimized(query, limit=10),
-            search_tracks_soundcloud(query, limit=10),
-        ]
-        
-        primary_term = query.split()[0]
-        if len(query.split()) > 1 and len(primary_term) > 2:
-             print(f"Hybrid search: using '{primary_term}' as a potential artist.")
-             tasks.extend([
-                search_tracks_yandex(primary_term, limit=10),
-                search_tracks_saavn(primary_term, limit=10)
-             ])
-        
-        all_raw_results = await asyncio.gather(*tasks, return_exceptions=True)
-
-        combined_all_candidates = []
-        seen_unique_ids = set()
-        for result_list in all_raw_results:
-            if isinstance(result_list, list):
-                for track in result_list:
-                    track_unique_id = f"{track.get('source', 'unknown')}_{track.get('id', 'unknown')}"
-                    if track_unique_id not in seen_unique_ids:
-                        combined_all_candidates.append(track)
-                        seen_unique_ids.add(track_unique_id)
-
-        final_results = merge_and_sort_results(query, combined_all_candidates)
-        final_filtered_results = filter_tracks_by_duration(final_results)
+        final_results, final_filtered_results = await search_single_flight(query, query_hash, on_progress=show_partial_results)
 
         if not final_filtered_results:
             await status_message.edit_text("❌ Трек не найден. Попробуй другой запрос или измени его (например, убери лишние слова).")
             return
 
-        await save_search_to_cache(query_hash, final_filtered_results)
         keyboard = await get_paginated_keyboard(final_filtered_results, query_hash, page=0)
 
         duration_info = f"⏱️ Показаны только треки до 15 минут.\n" if len(final_filtered_results) < len(final_results) else ""
         await status_message.edit_text(f"🎧 Найдено {len(final_filtered_results)} композиции. Выбери для скачивания:\n{duration_info}", reply_markup=keyboard)
+        # Пока пользователь выбирает, самые уверенные совпадения готовятся в фоне
+        schedule_prefetch(message.from_user.id, final_filtered_results, HIGH_CONFIDENCE_THRESHOLD)
 
     except Exception as e:
         await status_message.edit_text("❌ Ошибка поиска. Попробуй позже.")
@@ -261,13 +529,11 @@ async def handle_pagination(call: CallbackQuery):
             await call.message.delete()
             return
 
-        filtered_results = filter_tracks_by_duration(results)
-
-        if not filtered_results or page * PAGE_SIZE >= len(filtered_results):
+        if page * PAGE_SIZE >= len(results):
             await call.answer("На следующих страницах нет подходящих треков.", show_alert=True)
             return
         
-        keyboard = await get_paginated_keyboard(filtered_results, query_hash, page=page)
+        keyboard = await get_paginated_keyboard(results, query_hash, page=page)
         await call.message.edit_reply_markup(reply_markup=keyboard)
 
     except (ValueError, IndexError) as e:
@@ -296,7 +562,7 @@ async def handle_download(call: CallbackQuery):
         await call.answer("Ошибка: неверный формат данных для скачивания.", show_alert=True)
         return
 
-    can_download, message, _queue_pos, is_premium = await limitations.check_all_limits(bot, user_id, source)
+    can_download, message, is_premium = await limitations.check_all_limits(bot, user_id, source, track_id)
 
     if not can_download:
         if "Чтобы увеличить лимит" in message and limitations.CHANNEL_ID_2:
@@ -309,15 +575,32 @@ async def handle_download(call: CallbackQuery):
 
     limitations.downloading_users.add(user_id)
     await call.answer()
-    await call.message.edit_text(message)
 
-    priority = limitations.PRIORITY_PREMIUM if is_premium else limitations.PRIORITY_NORMAL
-    task_item = (priority, time.time(), (call, source, track_id))
+    # Этот трек уже в очереди или скачивается для кого-то: ждем тот же результат, а не ставим вторую задачу.
+    # Позицию и ожидание не показываем: они считались бы для конца очереди, а не для этой задачи
+    if limitations.join_pending_download(source, track_id, call):
+        await call.message.edit_text(f"🔗 Этот трек уже готовится — пришлю, как только он будет готов.{message}")
+        return
+    # Регистрация сразу после проверки, без await между ними: другие нажатия на этот трек присоединятся к задаче
+    waiters = []
+    limitations.register_download_job(source, track_id, waiters)
 
-    if source == 'yandex':
-        await limitations.slow_queue.put(task_item)
-    else:
-        await limitations.fast_queue.put(task_item)
+    pool = get_worker_pool(source)
+    priority = limitations.PRIORITY_PREMIUM if is_premium else limitations.PRIORITY_NORMAL
+    task_item = (priority, time.time(), (call, source, track_id, waiters))
+    try:
+        # Статус пишем до постановки в очередь, чтобы он не затер статус, который выставит воркер
+        try:
+            await call.message.edit_text(limitations.format_queue_message(source, pool.queue.qsize() + 1, is_premium) + message)
+        except TelegramAPIError as e:
+            print(f"Failed to show queue status to {user_id}: {e}")
+        await pool.submit(task_item)
+    except asyncio.QueueFull:
+        # Пока писался статус, очередь могла заполниться: отпускаем и успевших присоединиться
+        joined = list(waiters)
+        limitations.release_waiters(f"{source}_{track_id}", waiters)
+        limitations.downloading_users.discard(user_id)
+        await limitations.edit_job_status(call, joined, "😥Сервер сейчас перегружен. Пожалуйста, попробуй скачать трек через минуту.")
 
 async def start_periodic_db_cleanup():
     """Запускает бесконечный цикл для очистки устаревших записей в БД."""
@@ -327,27 +610,45 @@ async def start_periodic_db_cleanup():
         try:
             await cleanup_expired_cache()
             await cleanup_expired_soundcloud_urls()
+            await cleanup_old_downloads()
+            source_stats = format_source_stats()
+            if source_stats:
+                print(f"📊 Источники поиска:\n{source_stats}")
+            scheduler_stats = format_scheduler_stats()
+            if scheduler_stats:
+                print(f"🚦 Занятость источников:\n{scheduler_stats}")
+            worker_pool_stats = format_worker_pool_stats()
+            if worker_pool_stats:
+                print(f"👷 Воркеры скачиваний:\n{worker_pool_stats}")
+            breaker_states = format_breaker_states()
+            if breaker_states:
+                print(f"🔌 Предохранители источников:\n{breaker_states}")
+            flight_stats = get_single_flight_stats()
+            print(f"🔗 Поиски: {flight_stats['searches']} запущено, {flight_stats['coalesced']} присоединились к идущим "
+                  f"(сэкономлено {flight_stats['upstream_calls_saved']} запросов к источникам)")
+            hybrid_stats = get_hybrid_search_stats()
+            print(f"🎯 Гибридный поиск: расширен в {hybrid_stats['expanded']} из {hybrid_stats['eligible']} "
+                  f"многословных запросов ({hybrid_stats['expansion_rate']:.0%}), пропущен {hybrid_stats['skipped']}")
+            dedup_stats = limitations.download_dedup_stats
+            print(f"🧲 Скачивания: {dedup_stats['jobs']} задач, {dedup_stats['coalesced']} нажатий присоединились к идущим")
+            prefetch_stats = get_prefetch_stats()
+            print(f"⚡ Предзагрузка: запущено {prefetch_stats['scheduled']}, готово {prefetch_stats['completed']}, "
+                  f"ошибок {prefetch_stats['failed']}, отменено воркерами {prefetch_stats['cancelled']}, "
+                  f"не дождались {prefetch_stats['claim_timeouts']}, попаданий {prefetch_stats['hits']} "
+                  f"(точность {prefetch_stats['hit_rate']:.0%}, покрытие скачиваний {prefetch_stats['coverage']:.0%}), "
+                  f"напрасно {prefetch_stats['wasted']} ({prefetch_stats['wasted_bytes'] / 1024 ** 2:.1f} МБ)")
         except Exception as e:
             print(f"❌ Ошибка во время периодической очистки БД: {e}")
 
 async def on_startup(bot_instance: Bot):
     await init_db()
+    await init_audio_cache()
     await init_yandex_music_client()
+    await init_saavn_session()
+    await init_ydl_backend()
 
-    num_fast_workers = int(os.getenv('FAST_WORKERS', 6))
-    num_slow_workers = int(os.getenv('SLOW_WORKERS', 2))
-
-    print(f"🚀Запускаем {num_fast_workers} воркеров для быстрой очереди (YT/Saavn/SoundCloud)...")
-    for i in range(num_fast_workers):
-        asyncio.create_task(limitations.download_worker(
-            bot_instance, queue=limitations.fast_queue, worker_id=f'Fast-{i+1}'
-        ))
-
-    print(f"🚀Запускаем {num_slow_workers} воркеров для медленной очереди (Yandex)...")
-    for i in range(num_slow_workers):
-        asyncio.create_task(limitations.download_worker(
-            bot_instance, queue=limitations.slow_queue, worker_id=f'Slow-{i+1}'
-        ))
+    # У каждого источника своя очередь и свое число воркеров, которое подстраивается под нагрузку
+    start_worker_pools(lambda pool, worker_id: limitations.download_worker(bot_instance, pool, worker_id))
 
     asyncio.create_task(start_periodic_db_cleanup())
 
@@ -358,6 +659,10 @@ async def on_shutdown(bot_instance: Bot):
         await cleanup_client()
     except ImportError:
         pass
+    stop_worker_pools()
+    await close_saavn_session()
+    shutdown_ydl_backend()
+    await close_db()
     print("✅Бот корректно завершен.")
 
 if __name__ == '__main__':
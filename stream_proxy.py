@@ -2,13 +2,15 @@
 
 import base64
 import asyncio
-import yt_dlp
 import json
 from fastapi import FastAPI, HTTPException
 from fastapi.responses import StreamingResponse
 from cachetools import TTLCache
 import aiohttp
 
+from download_functions.ydl_pool import get_ydl_pool, extract_info, init_ydl_backend, shutdown_ydl_backend
+from download_functions.scheduler import source_slot, PRIORITY_DOWNLOAD
+
 app = FastAPI()
 
 # Кэш для хранения списков URL-ов сегментов.
@@ -19,16 +21,26 @@ SEGMENTS_CACHE = TTLCache(maxsize=1000, ttl=3600)
 # Единая сессия для aiohttp для переиспользования соединений
 AIOHTTP_SESSION = None
 
+# Готовые экземпляры yt-dlp для получения манифестов HLS
+HLS_YDL_OPTS = {
+    'quiet': True,
+    'dump_single_json': True, # Не скачивать, а выдать JSON с информацией
+    'format': 'bestaudio[ext=m4a]/bestaudio/best', # Приоритет m4a
+}
+HLS_YDL_POOL = get_ydl_pool('hls_manifest', HLS_YDL_OPTS)
+
 @app.on_event("startup")
 async def startup_event():
     global AIOHTTP_SESSION
     # Устанавливаем большой таймаут, т.к. скачивание может быть долгим
     timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=300)
     AIOHTTP_SESSION = aiohttp.ClientSession(timeout=timeout)
+    await init_ydl_backend()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     await AIOHTTP_SESSION.close()
+    shutdown_ydl_backend()
 
 MIME_TYPES = {
     'm4a': 'audio/mp4',
@@ -46,22 +58,15 @@ async def get_hls_segment_urls(track_url: str) -> list:
         return SEGMENTS_CACHE[track_url]
 
     print(f"CACHE MISS. Fetching segments for {track_url}")
-    ydl_opts = {
-        'quiet': True,
-        'dump_single_json': True, # Не скачивать, а выдать JSON с информацией
-        'format': 'bestaudio[ext=m4a]/bestaudio/best', # Приоритет m4a
-    }
     
-    # Используем run_in_executor, т.к. yt-dlp - блокирующая операция
-    loop = asyncio.get_event_loop()
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        try:
-            info_dict = await loop.run_in_executor(
-                None, lambda: ydl.extract_info(track_url, download=False)
-            )
-        except Exception as e:
-            print(f"yt-dlp extract_info failed: {e}")
-            raise HTTPException(status_code=502, detail="Upstream service (yt-dlp) failed.")
+    # yt-dlp блокирующий — выполняется в потоке или отдельном процессе (YDL_BACKEND)
+    try:
+        # Прокси — отдельный процесс со своим планировщиком, но с теми же лимитами SoundCloud
+        async with source_slot('soundcloud', PRIORITY_DOWNLOAD) as slot:
+            info_dict = await extract_info(HLS_YDL_POOL, track_url, slot=slot)
+    except Exception as e:
+        print(f"yt-dlp extract_info failed: {e}")
+        raise HTTPException(status_code=502, detail="Upstream service (yt-dlp) failed.")
 
     # Находим URL-ы сегментов внутри JSON
     fragments = info_dict.get('fragments')